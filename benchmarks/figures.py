@@ -0,0 +1,140 @@
+import argparse
+import random
+import timeit
+
+from cad.drawing import Drawing
+from cad.figures import *
+
+try:
+    from PyQt5.QtCore import QLineF, QPointF
+except ImportError:
+    QLineF = None
+
+
+# the geometry as it was before it dropped Qt: every length, dx and dy built
+# two QPointF and a QLineF, and point distances built a whole temporary line
+class LegacyPoint:
+    def __init__(self, x: float, y: float):
+        self.x = x
+        self.y = y
+
+    def distToPoint(self, point) -> float:
+        return LegacyLine(self, point).length
+
+    def distToVector(self, l) -> float:
+        if l.length == 0:
+            return LegacyLine(self, l.p1).length
+        s = l.dy * self.x - l.dx * self.y + l.x2 * l.y1 - l.y2 * l.x1
+        return abs(s) / l.length
+
+
+class LegacyLine:
+    def __init__(self, p1: LegacyPoint, p2: LegacyPoint):
+        self.p1 = p1
+        self.p2 = p2
+
+    def toQtLine(self):
+        return QLineF(QPointF(self.p1.x, self.p1.y), QPointF(self.p2.x, self.p2.y))
+
+    @property
+    def length(self) -> float:
+        return self.toQtLine().length()
+
+    @property
+    def dx(self) -> float:
+        return self.toQtLine().dx()
+
+    @property
+    def dy(self) -> float:
+        return self.toQtLine().dy()
+
+    @property
+    def x1(self) -> float:
+        return self.p1.x
+
+    @property
+    def x2(self) -> float:
+        return self.p2.x
+
+    @property
+    def y1(self) -> float:
+        return self.p1.y
+
+    @property
+    def y2(self) -> float:
+        return self.p2.y
+
+    def distToPoint(self, p: LegacyPoint) -> float:
+        if self.length == 0.:
+            return p.distToPoint(self.p1)
+        s = self.dy * p.x - self.dx * p.y + self.x2 * self.y1 - self.y2 * self.x1
+        return abs(s) / self.length
+
+    def hasPoint(self, point: LegacyPoint, offset: float = 0.) -> bool:
+        dist = point.distToVector(self)
+        if offset / 2 <= dist:
+            return False
+        if self.x1 <= point.x <= self.x2:
+            return True
+        if self.x2 <= point.x <= self.x1:
+            return True
+        return False
+
+
+CALLS = {
+    'length': lambda line, point: line.length,
+    'dx': lambda line, point: line.dx,
+    'Point.distToPoint': lambda line, point: point.distToPoint(line.p1),
+    'Line.distToPoint': lambda line, point: line.distToPoint(point),
+    'distToVector': lambda line, point: point.distToVector(line),
+    'hasPoint': lambda line, point: line.hasPoint(point, 10.),
+}
+
+
+def geometry(kind: str, count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    coordinates = [[rng.uniform(0, 1000) for i in range(6)] for j in range(count)]
+    if kind == 'legacy':
+        return [(LegacyLine(LegacyPoint(x1, y1), LegacyPoint(x2, y2)), LegacyPoint(x, y))
+                for x1, y1, x2, y2, x, y in coordinates]
+
+    pairs = [(Line(Point(x1, y1), Point(x2, y2)), Point(x, y)) for x1, y1, x2, y2, x, y in coordinates]
+    if kind == 'stored':
+        drawing = Drawing()
+        for line, point in pairs:
+            drawing.addLine(line)
+    return pairs
+
+
+# nanoseconds per call, the best of a few rounds over the same lines
+def measure(call, pairs: list, repeat: int) -> float:
+    timer = timeit.Timer(lambda: [call(line, point) for line, point in pairs])
+    return min(timer.repeat(repeat, number=1)) / len(pairs) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the per-call cost of the geometry primitives')
+    parser.add_argument('--count', type=int, default=10000, help='lines per round')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    kinds = ['loose', 'stored']
+    if QLineF is not None:
+        kinds.insert(0, 'legacy')
+    else:
+        print('PyQt5 is not installed, skipping the QLineF implementation')
+
+    samples = {kind: geometry(kind, args.count, seed=0) for kind in kinds}
+
+    print('{:<20}'.format('ns per call') + ''.join('{:>10}'.format(kind) for kind in kinds) +
+          ('{:>10}'.format('speedup') if 'legacy' in kinds else ''))
+    for name, call in CALLS.items():
+        times = [measure(call, samples[kind], args.repeat) for kind in kinds]
+        row = '{:<20}'.format(name) + ''.join('{:>10.0f}'.format(t) for t in times)
+        if 'legacy' in kinds:
+            row += '{:>9.1f}x'.format(times[0] / min(times[1:]))
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
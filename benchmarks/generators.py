@@ -0,0 +1,103 @@
+import numpy as np
+
+from cad.drawing import Drawing
+from cad.solver import *
+
+
+def jitter(random: np.random.Generator, x: float, y: float, noise: float) -> Point:
+    dx, dy = random.uniform(-noise, noise, 2)
+    return Point(x + dx, y + dy)
+
+
+# A polyline of n segments, each of fixed length, welded at the joints and
+# pinned at its first vertex: one cluster that grows with n
+def chain(n: int, noise: float = 2., seed: int = 0, **options) -> Drawing:
+    random = np.random.default_rng(seed)
+    drawing = Drawing(**options)
+    system = drawing.system
+
+    # one check of all the constraints once the sketch is built
+    with system.transaction():
+        previous = None
+        for i in range(n):
+            line = Line(jitter(random, i * 10., 0., noise), jitter(random, (i + 1) * 10., 0., noise))
+            drawing.addLine(line)
+            system.addConstraint(Length(line, 10.))
+
+            if previous is None:
+                system.addConstraint(FixingX(line.p1, 0.))
+                system.addConstraint(FixingY(line.p1, 0.))
+            else:
+                system.addConstraint(CoincidentX(previous.p2, line.p1))
+                system.addConstraint(CoincidentY(previous.p2, line.p1))
+            previous = line
+
+    return drawing
+
+
+# Rows of parallel segments with lengths, the first of each row at a fixed
+# angle: n lines in independent clusters of `row` lines
+def grid(n: int, row: int = 10, noise: float = 2., seed: int = 0, **options) -> Drawing:
+    random = np.random.default_rng(seed)
+    drawing = Drawing(**options)
+    system = drawing.system
+
+    # one check of all the constraints once the sketch is built
+    with system.transaction():
+        first = None
+        for i in range(n):
+            x, y = (i % row) * 30., (i // row) * 30.
+            line = Line(jitter(random, x, y, noise), jitter(random, x + 20., y + 10., noise))
+            drawing.addLine(line)
+            system.addConstraint(Length(line, 20.))
+
+            if i % row == 0:
+                first = line
+                system.addConstraint(Angle(line, 30.))
+            else:
+                system.addConstraint(Parallel(first, line))
+
+    return drawing
+
+
+# Fully constrained rectangles: welded corners, horizontal and vertical
+# sides, two lengths and a fixed corner, n / 4 independent clusters
+def rectangles(n: int, noise: float = 2., seed: int = 0, **options) -> Drawing:
+    random = np.random.default_rng(seed)
+    drawing = Drawing(**options)
+    system = drawing.system
+
+    # one check of all the constraints once the sketch is built
+    with system.transaction():
+        for i in range(max(n // 4, 1)):
+            x, y = (i % 50) * 60., (i // 50) * 60.
+            corners = [(x, y), (x + 40., y), (x + 40., y + 20.), (x, y + 20.)]
+
+            lines = []
+            for (x1, y1), (x2, y2) in zip(corners, corners[1:] + corners[:1]):
+                line = Line(jitter(random, x1, y1, noise), jitter(random, x2, y2, noise))
+                drawing.addLine(line)
+                lines.append(line)
+
+            for previous, line in zip(lines, lines[1:] + lines[:1]):
+                system.addConstraint(CoincidentX(previous.p2, line.p1))
+                system.addConstraint(CoincidentY(previous.p2, line.p1))
+
+            system.addConstraint(Horizontal(lines[0]))
+            system.addConstraint(Vertical(lines[1]))
+            system.addConstraint(Horizontal(lines[2]))
+            system.addConstraint(Vertical(lines[3]))
+
+            system.addConstraint(Length(lines[0], 40.))
+            system.addConstraint(Length(lines[1], 20.))
+            system.addConstraint(FixingX(lines[0].p1, x))
+            system.addConstraint(FixingY(lines[0].p1, y))
+
+    return drawing
+
+
+GENERATORS = {
+    'chain': chain,
+    'grid': grid,
+    'rectangles': rectangles,
+}
@@ -0,0 +1,108 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from cad.drawing import Drawing
+from cad.figures import *
+from cad.index import pointDistances, segmentDistances
+
+TOLERANCES = ((Point, 4.), (Line, 2.))
+
+
+# what the sketch did on every mouse event before the grid: a python loop
+# over every line and vertex
+def loop(drawing: Drawing, position: Point):
+    for line in drawing.lines:
+        for point in line.points:
+            if point.distToPoint(position) < 4:
+                return point
+    for point in drawing.points:
+        if point.distToPoint(position) < 4:
+            return point
+    for line in drawing.lines:
+        if line.hasPoint(position, 4):
+            return line
+    return None
+
+
+# the same test as one numpy pass over every segment in the store
+def vectorized(drawing: Drawing, position: Point):
+    lines, segments = drawing.store.segments()
+    x, y = position.coordinates
+    distances = pointDistances(segments.reshape(-1, 2), x, y)
+    i = int(np.argmin(distances)) if len(distances) else 0
+    if len(distances) and distances[i] < 4:
+        return lines[i // 2].points[i % 2]
+    distances = segmentDistances(segments, x, y)
+    i = int(np.argmin(distances)) if len(distances) else 0
+    if len(distances) and distances[i] < 2:
+        return lines[i]
+    return None
+
+
+def indexed(drawing: Drawing, position: Point):
+    return drawing.index.nearest(position, TOLERANCES)
+
+
+QUERIES = {
+    'loop': loop,
+    'numpy': vectorized,
+    'grid': indexed,
+}
+
+
+# random short segments over a square that grows with the count, so the
+# density around the cursor stays the same
+def drawing(size: int, seed: int) -> Drawing:
+    rng = random.Random(seed)
+    side = 100. * size ** .5
+    result = Drawing()
+    for i in range(size):
+        x, y = rng.uniform(0, side), rng.uniform(0, side)
+        result.addLine(Line(Point(x, y), Point(x + rng.uniform(-50, 50), y + rng.uniform(-50, 50))))
+    return result
+
+
+# microseconds per query, over positions half of which sit on a line
+def measure(query, sample: Drawing, positions: list) -> float:
+    start = time.perf_counter()
+    for position in positions:
+        query(sample, position)
+    return (time.perf_counter() - start) / len(positions) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the hit test under the cursor on synthetic drawings')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000, 50000])
+    parser.add_argument('--queries', nargs='+', default=list(QUERIES), choices=list(QUERIES))
+    parser.add_argument('--count', type=int, default=200, help='positions per size')
+    args = parser.parse_args()
+
+    print('{:>8}'.format('lines') + ''.join('{:>12}'.format(name + ' us') for name in args.queries))
+    for size in args.sizes:
+        sample = drawing(size, seed=0)
+        rng = random.Random(1)
+        side = 100. * size ** .5
+        positions = []
+        for i in range(args.count):
+            if i % 2:
+                line = rng.choice(sample.lines)
+                t = rng.random()
+                positions.append(Point(line.x1 + t * line.dx, line.y1 + t * line.dy))
+            else:
+                positions.append(Point(rng.uniform(0, side), rng.uniform(0, side)))
+
+        # the loop takes the first hit and the others the closest, but all of
+        # them have to agree on whether anything is under the cursor
+        for position in positions:
+            hits = {QUERIES[name](sample, position) is None for name in args.queries}
+            assert len(hits) == 1, position.coordinates
+
+        times = [measure(QUERIES[name], sample, positions) for name in args.queries]
+        print('{:>8}'.format(size) + ''.join('{:>12.1f}'.format(t) for t in times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+import scipy
+
+from benchmarks.generators import GENERATORS
+from cad.solver import *
+
+BACKENDS = {
+    'newton': NewtonBackend,
+    'fsolve': FsolveBackend,
+    'lsq': LeastSquaresBackend,
+}
+
+
+def revision() -> str:
+    try:
+        command = ['git', 'rev-parse', '--short', 'HEAD']
+        return subprocess.check_output(command, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(generator: str, size: int, backend: str, repeat: int) -> dict:
+    times = []
+    for i in range(repeat):
+        drawing = GENERATORS[generator](size, seed=i, backend=BACKENDS[backend]())
+        system = drawing.system
+
+        start = time.perf_counter()
+        system.recount()
+        times.append(time.perf_counter() - start)
+    stats = system.stats
+
+    # nudge one vertex and re-solve its cluster from the previous solution
+    point = drawing.lines[len(drawing.lines) // 2].p2
+    point.x += 1.
+    system.touch(point)
+
+    start = time.perf_counter()
+    system.recount()
+    warm = time.perf_counter() - start
+
+    return {
+        'generator': generator,
+        'size': size,
+        'backend': backend,
+        'recount': min(times),
+        'warm': warm,
+        'nfev': stats.nfev,
+        'njev': stats.njev,
+        'residual': stats.residual,
+        'variables': stats.variables,
+        'constraints': stats.constraints,
+        'clusters': stats.clusters,
+        'converged': stats.converged,
+    }
+
+
+# slope of log(time) over log(size): 1 is linear scaling, 3 cubic
+def exponent(results: list) -> float:
+    if len(results) < 2:
+        return float('nan')
+    sizes = np.log([result['size'] for result in results])
+    times = np.log([max(result['recount'], 1e-9) for result in results])
+    return float(np.polyfit(sizes, times, 1)[0])
+
+
+def report(results: list, baseline: list = None):
+    previous = {(r['generator'], r['size'], r['backend']): r for r in baseline or []}
+
+    print('{:<12}{:>8}{:>8}{:>12}{:>12}{:>8}{:>10}{:>10}'.format(
+        'generator', 'size', 'backend', 'recount ms', 'warm ms', 'nfev', 'converged', 'vs base'))
+    for result in results:
+        old = previous.get((result['generator'], result['size'], result['backend']))
+        ratio = '{:.2f}x'.format(result['recount'] / old['recount']) if old else ''
+        print('{:<12}{:>8}{:>8}{:>12.2f}{:>12.2f}{:>8}{:>10}{:>10}'.format(
+            result['generator'], result['size'], result['backend'], result['recount'] * 1000,
+            result['warm'] * 1000, result['nfev'], str(result['converged']), ratio))
+
+    print()
+    for generator in sorted({result['generator'] for result in results}):
+        for backend in sorted({result['backend'] for result in results}):
+            curve = [r for r in results if r['generator'] == generator and r['backend'] == backend]
+            if curve:
+                print('{} / {}: time ~ size^{:.2f}'.format(generator, backend, exponent(curve)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the constraint solver on synthetic sketches')
+    parser.add_argument('--generators', nargs='+', default=sorted(GENERATORS), choices=sorted(GENERATORS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument('--backends', nargs='+', default=['newton'], choices=sorted(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='results file of a previous run to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for generator in args.generators:
+        for backend in args.backends:
+            for size in args.sizes:
+                results.append(measure(generator, size, backend, args.repeat))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    report(results, baseline)
+
+    with open(args.output, 'w') as fp:
+        json.dump({
+            'revision': revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'results': results,
+        }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ from ezdxf.entities import Circle
 
 from cad.sketch import Sketch
 from cad.solver import *
+from cad.handlers import *
 
 # get the directory of the current file
 directory = os.path.dirname(__file__)
@@ -75,6 +76,7 @@ class Application(QMainWindow):
         view.addAction(self.ChangeContrast())
         view.addAction(self.zoomi())
         view.addAction(self.zoomo())
+        view.addAction(self.zoomFit())
 
         # Help menu
         help = self.menu.addMenu("Help")
@@ -129,15 +131,28 @@ class Application(QMainWindow):
     # Define and configure the "Zoom In" action
     def zoomi(self):
         action = QAction('Zoom In', self)
+        action.setShortcut('Ctrl++')
         action.setStatusTip('Zoom In')
         action.setToolTip('Zoom In')
+        action.triggered.connect(lambda: self.sketch.zoom(1.25))
         return action
 
     # Define and configure the "Zoom Out" action
     def zoomo(self):
         action = QAction('Zoom Out', self)
+        action.setShortcut('Ctrl+-')
         action.setStatusTip('Zoom Out')
         action.setToolTip('Zoom Out')
+        action.triggered.connect(lambda: self.sketch.zoom(0.8))
+        return action
+
+    # Define and configure the "Zoom to Fit" action
+    def zoomFit(self):
+        action = QAction('Zoom to Fit', self)
+        action.setShortcut('Ctrl+0')
+        action.setStatusTip('Show the whole drawing')
+        action.setToolTip('Zoom to Fit')
+        action.triggered.connect(self.sketch.fit)
         return action
 
     # Define and configure the "About Us" action
@@ -267,6 +282,7 @@ class Application(QMainWindow):
             self.polylineAction(),
             self.drawCircleAction(),
             self.EraserAction(),
+            self.lassoAction(),
         ]
 
         for action in actions:
@@ -276,6 +292,7 @@ class Application(QMainWindow):
             self.toolBarGroup.addAction(action)
 
         default.setChecked(True)
+        self.sketch.handler = SelectionHandler()
 
     # Define and configure the "Point" action
     def pointAction(self):
@@ -538,16 +555,52 @@ class Application(QMainWindow):
         action.triggered.connect(self.disableActionHandler)
         return action
 
-    # Handler for the "Disable" action
+    # Handler for the "Disable" action, the cursor selects with a box
     def disableActionHandler(self):
         for action in self.toolBarGroup.actions():
             action.setChecked(False)
 
         self.toolBarGroup.actions()[0].setChecked(True)
+        self.sketch.handler = SelectionHandler()
+
+    # Define and configure the "Lasso" action
+    def lassoAction(self):
+        action = QAction('Lasso')
+        action.setToolTip('Lasso selection')
+        action.setStatusTip('Lasso selection')
+        # no lasso among the bundled icons, the button shows its text when
+        # the desktop theme has none either
+        action.setIcon(QIcon.fromTheme('edit-select-lasso'))
+        action.triggered.connect(self.lassoActionHandler)
+        return action
+
+    # Handler for the "Lasso" action
+    def lassoActionHandler(self):
+        self.sketch.handler = LassoHandler()
 
     # Initialize the status bar
     def initStatusBar(self):
         self.statusBar().showMessage('Ready')
+        self.sketch.solvingChanged.connect(self.solvingChanged)
+        self.sketch.solved.connect(self.solverStats)
+        self.sketch.constraintRejected.connect(self.constraintRejected)
+
+    # Show whether the constraint solver is running in the background
+    def solvingChanged(self, solving: bool):
+        if solving:
+            self.statusBar().showMessage('Solving…')
+        else:
+            self.solverStats(self.sketch.system.stats)
+
+    # Show a summary of the last recount
+    def solverStats(self, stats):
+        if not self.sketch.solving:
+            message = stats.summary if stats else 'Ready'
+            self.statusBar().showMessage('{}, {} DOF'.format(message, self.sketch.drawing.dof))
+
+    # Explain why a constraint was not added
+    def constraintRejected(self, message: str):
+        self.statusBar().showMessage(message, 5000)
 
     # Initialize the application window geometry
     def initGeometry(self):
@@ -561,20 +614,24 @@ class Application(QMainWindow):
         if files:
             doc = ezdxf.readfile(files)
             msp = doc.modelspace()
-            self.sketch.lines.clear()  # Clear existing lines
-            self.sketch.circles.clear()  # Clear existing circles
-            for entity in msp.query('LINE'):
-                start_point = entity.dxf.start
-                end_point = entity.dxf.end
-                p1 = Point(start_point.x, -start_point.y)  # Invert Y-coordinate as needed
-                p2 = Point(end_point.x, -end_point.y)  # Invert Y-coordinate as needed
-                self.sketch.addLine(Line(p1, p2))
-            for entity in msp.query('CIRCLE'):
-                center = entity.dxf.center
-                radius = entity.dxf.radius
-                center_point = Point(center.x, -center.y)  # Invert Y-coordinate as needed
-                self.sketch.addCircle(Circle(center_point, radius))
-            self.sketch.update()
+            # One recount and repaint for the whole file
+            with self.sketch.transaction():
+                self.sketch.clearSelection()
+                self.sketch.drawing.clear()  # Clear the existing drawing
+                for entity in msp.query('LINE'):
+                    start_point = entity.dxf.start
+                    end_point = entity.dxf.end
+                    p1 = Point(start_point.x, -start_point.y)  # Invert Y-coordinate as needed
+                    p2 = Point(end_point.x, -end_point.y)  # Invert Y-coordinate as needed
+                    self.sketch.addLine(Line(p1, p2))
+                for entity in msp.query('CIRCLE'):
+                    center = entity.dxf.center
+                    radius = entity.dxf.radius
+                    center_point = Point(center.x, -center.y)  # Invert Y-coordinate as needed
+                    self.sketch.addCircle(Circle(center_point, radius))
+            # the file sets the scale the grid is binned at
+            self.sketch.drawing.index.fit()
+            self.sketch.fit()
 
     # Show the save file as dxf dialog
     def saveImage(self):
@@ -593,11 +650,9 @@ class Application(QMainWindow):
             doc = ezdxf.new()
             msp = doc.modelspace()
 
-            # Export lines
-            for line in self.sketch.lines:
-                p1_tuple = (line.p1.x, line.p1.y)
-                p2_tuple = (line.p2.x, line.p2.y)
-                msp.add_lwpolyline([p1_tuple, p2_tuple])
+            # Export lines, joined into one polyline through welded vertices
+            for polyline in self.sketch.drawing.polylines():
+                msp.add_lwpolyline([(point.x, point.y) for point in polyline])
 
             # Export circles
             for circle in self.sketch.circles:
@@ -636,6 +691,7 @@ class Application(QMainWindow):
 
         answer = QMessageBox().question(self, title, question, buttons, default)
         if answer == QMessageBox.Yes:
+            self.sketch.shutdown()
             event.accept()
         else:
             event.ignore()
@@ -0,0 +1,281 @@
+import numpy as np
+
+from cad.figures import *
+from cad.index import Grid
+from cad.solver import System
+from cad.store import Store
+
+
+class VertexTable(object):
+
+    # union-find of welded points: the lines of a group all share its root,
+    # the other members are kept to split the vertex again
+    def __init__(self):
+        self.parents = {}
+        self.groups = {}
+
+    def find(self, point: Point) -> Point:
+        root = point
+        while root in self.parents:
+            root = self.parents[root]
+        while point is not root:
+            self.parents[point], point = root, self.parents[point]
+        return root
+
+    def members(self, point: Point) -> list:
+        root = self.find(point)
+        return self.groups[root][0] if root in self.groups else [root]
+
+    def union(self, p1: Point, p2: Point) -> tuple:
+        root, merged = self.find(p1), self.find(p2)
+        if root is merged:
+            return root, None
+
+        # the larger group keeps its root, fewer references to move
+        if len(self.members(merged)) > len(self.members(root)):
+            root, merged = merged, root
+
+        members, history = self.groups.pop(root, ([root], []))
+        others, previous = self.groups.pop(merged, ([merged], []))
+        self.parents[merged] = root
+        self.groups[root] = members + others, history + previous
+        return root, merged
+
+    def record(self, root: Point, change: tuple):
+        self.groups[root][1].append(change)
+
+    def split(self, point: Point) -> tuple:
+        root = self.find(point)
+        members, history = self.groups.pop(root, ([root], []))
+        for member in members:
+            self.parents.pop(member, None)
+        return root, history
+
+
+class Drawing(object):
+
+    def __init__(self, **options):
+        self.lines = []
+        self.points = []
+        self.circles = []
+
+        self.store = Store()
+        self.index = Grid(self.store)
+        self.vertices = VertexTable()
+        self.system = System(self, **options)
+
+    def addLine(self, line: Line):
+        self.lines.append(line)
+        self.store.addLine(line)
+        self.index.addLine(line)
+        self.system.invalidate()
+
+    def removeLine(self, line: Line):
+        self.lines.remove(line)
+        self.index.removeLine(line)
+        self.store.removeLine(line)
+        self.system.invalidate(erased=True)
+
+    def addPoint(self, point: Point):
+        self.points.append(point)
+        self.store.attach(point)
+        self.index.addPoint(point)
+        self.system.invalidate()
+
+    def removePoint(self, point: Point):
+        self.points.remove(point)
+        self.index.removePoint(point)
+        self.store.release(point)
+        self.system.invalidate(erased=True)
+
+    def addCircle(self, circle: Circle):
+        self.circles.append(circle)
+        self.store.addCircle(circle)
+        self.index.addCircle(circle)
+        self.system.touch()
+
+    def removeCircle(self, circle: Circle):
+        self.circles.remove(circle)
+        self.index.removeCircle(circle)
+        self.store.removeCircle(circle)
+        self.system.touch()
+
+    def remove(self, figures):
+        # many figures at once: the lists are filtered once and the system
+        # invalidated once. a point is only erased when it is a free point
+        figures = set(figures)
+        lines = [line for line in self.lines if line in figures]
+        points = [point for point in self.points if point in figures]
+        circles = [circle for circle in self.circles if circle in figures]
+        for line in lines:
+            self.index.removeLine(line)
+            self.store.removeLine(line)
+        for point in points:
+            self.index.removePoint(point)
+            self.store.release(point)
+        for circle in circles:
+            self.index.removeCircle(circle)
+            self.store.removeCircle(circle)
+        self.lines[:] = [line for line in self.lines if line not in figures]
+        self.points[:] = [point for point in self.points if point not in figures]
+        self.circles[:] = [circle for circle in self.circles if circle not in figures]
+        self.system.invalidate(erased=True)
+
+    def translate(self, points, dx: float, dy: float):
+        # moves the points in one write to the store, one solve follows
+        points = list(dict.fromkeys(points))
+        slots = np.fromiter((point.slot for point in points), dtype=int, count=len(points))
+        self.store.coordinates[slots] += dx, dy
+        self.store.moved.update(slots.tolist())
+        self.store.changed()
+        self.system.touch(*points)
+
+    def clear(self):
+        self.lines.clear()
+        self.points.clear()
+        self.circles.clear()
+        self.store.clear()
+        self.index.clear()
+        self.vertices = VertexTable()
+        self.system.invalidate(erased=True)
+
+    def addConstraint(self, constraint, check: bool = True):
+        self.system.addConstraint(constraint, check)
+
+    @property
+    def dof(self) -> int:
+        return self.system.dof
+
+    def weld(self, p1: Point, p2: Point) -> Point:
+        p1, p2 = self.vertices.find(p1), self.vertices.find(p2)
+        if p1 is p2:
+            return p1
+        # raises before anything changes when the weld conflicts
+        self.system.identify(p1, p2)
+
+        root, merged = self.vertices.union(p1, p2)
+
+        # everything that referred to the merged point moves onto the root
+        lines = [entity for entity in self.index.incident.get(merged, ()) if isinstance(entity, Line)]
+        ends = [(line, name) for line in lines for name in ('p1', 'p2') if getattr(line, name) is merged]
+        for line, name in ends:
+            setattr(line, name, root)
+        constraints = self.system.replace(merged, root)
+        free = merged in self.points
+        if free:
+            self.points.remove(merged)
+            self.index.removePoint(merged)
+            self.store.release(merged)
+        for line, name in ends:
+            self.index.update(line)
+
+        self.vertices.record(root, (merged, ends, constraints, free))
+        self.system.invalidate()
+        return root
+
+    def unweld(self, point: Point):
+        root, history = self.vertices.split(point)
+
+        # undo the merges latest first, each point gets back what it had
+        for merged, ends, constraints, free in reversed(history):
+            merged.x, merged.y = root.coordinates
+            # lines erased since the weld are out of the store and the index
+            ends = [(line, name) for line, name in ends if line.store is self.store]
+            for line, name in ends:
+                setattr(line, name, merged)
+            for constraint, names in constraints:
+                for name in names:
+                    setattr(constraint, name, merged)
+            for line, name in ends:
+                self.index.update(line)
+            if free:
+                self.points.append(merged)
+                self.store.attach(merged)
+                self.index.addPoint(merged)
+
+        if history:
+            self.system.invalidate(erased=True)
+
+    def extents(self) -> tuple:
+        # (x1, y1, x2, y2) around every vertex and circle, None when empty
+        store = self.store
+        corners = [store.coordinates[store.points.rows]]
+        if self.circles:
+            circles = store.circles.data[store.circles.rows]
+            centers = store.coordinates[circles['center']]
+            radius = circles['radius'][:, None]
+            corners += [centers - radius, centers + radius]
+        corners = np.concatenate(corners)
+        if not len(corners):
+            return None
+        (x1, y1), (x2, y2) = corners.min(axis=0).tolist(), corners.max(axis=0).tolist()
+        return x1, y1, x2, y2
+
+    def visible(self, x1: float, y1: float, x2: float, y2: float, excluded: set = frozenset()) -> tuple:
+        # the segments, vertices and free points, and circles as (x, y, radius)
+        # that reach into the rectangle, but for the excluded figures. a small
+        # rectangle only walks the cells of the grid under it, a large one
+        # culls the whole store at once
+        store = self.store
+        (i1, j1), (i2, j2) = self.index.cell(x1, y1), self.index.cell(x2, y2)
+        if (i2 - i1 + 1) * (j2 - j1 + 1) < len(self.index.cells):
+            figures = self.index.region(x1, y1, x2, y2) - excluded
+            segments = store.segmentsOf([figure for figure in figures if isinstance(figure, Line)])
+            slots = [figure.slot for figure in figures if isinstance(figure, Point)]
+            circles = [figure for figure in figures if isinstance(figure, Circle)]
+        else:
+            rows = store.lines.rows
+            slots = store.lines.data[rows]
+            segments = store.coordinates[slots].reshape(-1, 4)
+            slots = np.concatenate([slots.reshape(-1), [point.slot for point in self.points]])
+            circles = self.circles
+            if excluded:
+                lines = [figure.row for figure in excluded if isinstance(figure, Line)]
+                points = [figure.slot for figure in excluded if isinstance(figure, Point)]
+                segments = segments[~np.isin(rows, lines)]
+                slots = slots[~np.isin(slots, points)]
+                circles = [circle for circle in circles if circle not in excluded]
+            lows = np.minimum(segments[:, :2], segments[:, 2:])
+            highs = np.maximum(segments[:, :2], segments[:, 2:])
+            segments = segments[(lows[:, 0] <= x2) & (highs[:, 0] >= x1) & (lows[:, 1] <= y2) & (highs[:, 1] >= y1)]
+
+        vertices = store.coordinates[np.unique(np.asarray(slots, dtype=int))]
+        vertices = vertices[(vertices[:, 0] >= x1) & (vertices[:, 0] <= x2) &
+                            (vertices[:, 1] >= y1) & (vertices[:, 1] <= y2)]
+        circles = np.array([circle.center.coordinates + (circle.radius,) for circle in circles]).reshape(-1, 3)
+        circles = circles[(circles[:, 0] + circles[:, 2] >= x1) & (circles[:, 0] - circles[:, 2] <= x2) &
+                          (circles[:, 1] + circles[:, 2] >= y1) & (circles[:, 1] - circles[:, 2] <= y2)]
+        return segments, vertices, circles
+
+    def polylines(self) -> list:
+        # chains of lines joined at welded vertices, as lists of points
+        incident = {}
+        for line in self.lines:
+            for point in line.points:
+                incident.setdefault(point, []).append(line)
+
+        def walk(point: Point, line: Line, visited: set) -> list:
+            chain = [point]
+            while line is not None and line not in visited:
+                visited.add(line)
+                point = line.p2 if line.p1 is point else line.p1
+                chain.append(point)
+                lines = incident[point]
+                if len(lines) != 2:
+                    break
+                line = lines[1] if lines[0] is line else lines[0]
+            return chain
+
+        visited = set()
+        polylines = []
+        # open chains start at the vertices that do not join exactly two lines
+        for point, lines in incident.items():
+            if len(lines) != 2:
+                for line in lines:
+                    if line not in visited:
+                        polylines.append(walk(point, line, visited))
+        # what is left are closed loops
+        for line in self.lines:
+            if line not in visited:
+                polylines.append(walk(line.p1, line, visited))
+        return polylines
@@ -1,55 +1,113 @@
-from PyQt5.QtCore import QPointF, QLineF, QRect
-from cad import pen
+import math
 
 
 class Point:
+    __slots__ = ('store', 'slot', '__x', '__y')
+
     def __init__(self, x: float, y: float):
+        # row of the point in the coordinate buffer of a store, once added
+        self.store = None
+        self.slot = -1
+
         self.x = x
         self.y = y
 
     @property
     def x(self) -> float:
-        return self.__x
+        if self.store is None:
+            return self.__x
+        return self.store.flat[2 * self.slot]
 
     @property
     def y(self) -> float:
-        return self.__y
+        if self.store is None:
+            return self.__y
+        return self.store.flat[2 * self.slot + 1]
 
     @y.setter
     def y(self, y: float):
-        self.__y = y
+        if self.store is None:
+            self.__y = y
+        else:
+            self.store.flat[2 * self.slot + 1] = y
+            self.store.moved.add(self.slot)
+            self.store.version += 1
 
     @x.setter
     def x(self, x: float):
-        self.__x = x
+        if self.store is None:
+            self.__x = x
+        else:
+            self.store.flat[2 * self.slot] = x
+            self.store.moved.add(self.slot)
+            self.store.version += 1
 
     @property
     def coordinates(self) -> tuple:
-        return self.x, self.y
+        if self.store is None:
+            return self.__x, self.__y
+        flat = self.store.flat
+        return flat[2 * self.slot], flat[2 * self.slot + 1]
 
-    def toQtPoint(self) -> QPointF:
-        return QPointF(self.x, self.y)
+    def attach(self, store, slot: int):
+        self.store = store
+        self.slot = slot
 
-    @classmethod
-    def fromQtPoint(cls, point: QPointF):
-        return cls(point.x(), point.y())
+    def detach(self):
+        self.__x, self.__y = self.coordinates
+        self.store = None
+        self.slot = -1
+
+    def __reduce__(self):
+        # copies travel without the store they view
+        return Point, self.coordinates
 
     def distToPoint(self, point) -> float:
-        return Line(self, point).length
+        x, y = self.coordinates
+        return math.hypot(point.x - x, point.y - y)
 
     def distToVector(self, l) -> float:
-        if l.length == 0:
-            return Line(self, l.p1).length
-        s = l.dy * self.x - l.dx * self.y + l.x2 * l.y1 - l.y2 * l.x1
-        return abs(s) / l.length
+        return l.distToPoint(self)
 
 class Circle:
-    def __init__(self, center, radius, outline_color=pen.COLOR):
+    __slots__ = ('store', 'row', 'center', '__radius', 'outline_color', 'selected')
+
+    def __init__(self, center, radius, outline_color=None):
+        self.store = None
+        self.row = -1
+
         self.center = center
         self.radius = radius
         self.outline_color = outline_color
         self.selected = False
 
+    @property
+    def radius(self) -> float:
+        if self.store is None:
+            return self.__radius
+        return float(self.store.circles.data[self.row]['radius'])
+
+    @radius.setter
+    def radius(self, radius: float):
+        if self.store is None:
+            self.__radius = radius
+        else:
+            self.store.circles.data[self.row]['radius'] = radius
+            self.store.moved.add(self.center.slot)
+            self.store.version += 1
+
+    def attach(self, store, row: int):
+        self.store = store
+        self.row = row
+
+    def detach(self):
+        self.__radius = self.radius
+        self.store = None
+        self.row = -1
+
+    def __reduce__(self):
+        return Circle, (self.center, self.radius, self.outline_color)
+
     def contains(self, point):
         # Check if the point is within the circle
         return self.center.distToPoint(point) <= self.radius
@@ -60,19 +118,17 @@ class Circle:
     def deselect(self):
         self.selected = False
 
-    def toQtRect(self):
-        # Calculate integer coordinates for the rectangle
-        x = int(self.center.x - self.radius)
-        y = int(self.center.y - self.radius)
-        width = int(2 * self.radius)
-        height = int(2 * self.radius)
-
-        # Create and return a QRect object
-        return QRect(x, y, width, height)
 class Line:
+    __slots__ = ('store', 'row', '__p1', '__p2', '__cache')
+
     def __init__(self, p1: Point, p2: Point):
-        self.p1 = p1
-        self.p2 = p2
+        # row of the line in the line table of a store, once added
+        self.store = None
+        self.row = -1
+        self.__cache = None
+
+        self.__p1 = p1
+        self.__p2 = p2
 
     @property
     def p1(self) -> Point:
@@ -84,35 +140,66 @@ class Line:
 
     @p1.setter
     def p1(self, p1: Point):
+        if self.store is not None:
+            self.store.setEndpoint(self, 0, self.__p1, p1)
         self.__p1 = p1
+        self.__cache = None
 
     @p2.setter
     def p2(self, p2: Point):
+        if self.store is not None:
+            self.store.setEndpoint(self, 1, self.__p2, p2)
         self.__p2 = p2
+        self.__cache = None
+
+    def attach(self, store, row: int):
+        self.store = store
+        self.row = row
+        self.__cache = None
+
+    def detach(self):
+        self.store = None
+        self.row = -1
+        self.__cache = None
+
+    def __reduce__(self):
+        return Line, (self.p1, self.p2)
+
+    def geometry(self) -> tuple:
+        # (x1, y1, x2, y2, dx, dy, length); lines in a store keep it until the
+        # store changes, loose points can move unseen so those are recomputed
+        store = self.store
+        if store is not None:
+            cache = self.__cache
+            if cache is not None and cache[0] == store.version:
+                return cache[1]
+        x1, y1 = self.__p1.coordinates
+        x2, y2 = self.__p2.coordinates
+        dx = x2 - x1
+        dy = y2 - y1
+        geometry = x1, y1, x2, y2, dx, dy, math.hypot(dx, dy)
+        if store is not None:
+            self.__cache = store.version, geometry
+        return geometry
 
     @property
     def points(self) -> tuple:
         return self.p1, self.p2
 
     def coordinates(self) -> tuple:
-        return self.p1.x, self.p1.x, self.p2.x, self.p2.y
-
-    def toQtLine(self) -> QLineF:
-        p1 = self.p1.toQtPoint()
-        p2 = self.p2.toQtPoint()
-        return QLineF(p1, p2)
+        return self.geometry()[:4]
 
     @property
     def length(self) -> float:
-        return self.toQtLine().length()
+        return self.geometry()[6]
 
     @property
     def dx(self) -> float:
-        return self.toQtLine().dx()
+        return self.geometry()[4]
 
     @property
     def dy(self) -> float:
-        return self.toQtLine().dy()
+        return self.geometry()[5]
 
     @property
     def x1(self) -> float:
@@ -130,24 +217,22 @@ class Line:
     def y2(self) -> float:
         return self.p2.y
 
-    @classmethod
-    def fromQtLine(cls, line: QLineF):
-        p1 = Point.fromQtPoint(line.p1())
-        p2 = Point.fromQtPoint(line.p2())
-        return cls(p1, p2)
-
     def distToPoint(self, p: Point) -> float:
-        if self.length == 0.:
-            return p.distToPoint(self.p1)
-        s = self.dy * p.x - self.dx * p.y + self.x2 * self.y1 - self.y2 * self.x1
-        return abs(s) / self.length
+        x1, y1, x2, y2, dx, dy, length = self.geometry()
+        x, y = p.coordinates
+        if length == 0.:
+            return math.hypot(x - x1, y - y1)
+        s = dy * x - dx * y + x2 * y1 - y2 * x1
+        return abs(s) / length
+
+    def distToSegment(self, p: Point) -> float:
+        # to the closest point between the endpoints, not on the infinite line
+        x1, y1, x2, y2, dx, dy, length = self.geometry()
+        x, y = p.coordinates
+        if length == 0.:
+            return math.hypot(x - x1, y - y1)
+        t = min(max(((x - x1) * dx + (y - y1) * dy) / (length * length), 0.), 1.)
+        return math.hypot(x - x1 - t * dx, y - y1 - t * dy)
 
     def hasPoint(self, point: Point, offset: float = 0.) -> bool:
-        dist = point.distToVector(self)
-        if offset / 2 <= dist:
-            return False
-        if self.x1 <= point.x <= self.x2:
-            return True
-        if self.x2 <= point.x <= self.x1:
-            return True
-        return False
+        return self.distToSegment(point) < offset / 2
@@ -0,0 +1,393 @@
+from PyQt5 import QtCore, QtGui
+
+from cad import pen
+from cad.figures import *
+from cad.render import toQtPoint
+from cad.solver import *
+
+
+class Handler:
+
+    def mouseMoved(self, sketch):
+        pass
+
+    def mousePressed(self, sketch):
+        pass
+
+    def mouseReleased(self, sketch):
+        pass
+
+    def draw(self, painter):
+        pass
+
+    def cancel(self, sketch):
+        # the sketch switched to another handler, possibly mid gesture
+        pass
+
+    def moving(self, sketch) -> set:
+        # figures a gesture in progress moves on every frame, painted over the
+        # cached layer instead of in it
+        return set()
+
+    def targets(self, sketch, figure) -> list:
+        # a figure picked inside the selection stands for the whole selection
+        # of its kind
+        if figure in sketch.selection:
+            return [other for other in sketch.selection if isinstance(other, type(figure))]
+        return [figure]
+
+
+class DisableHandler(Handler):
+    pass
+
+
+class SelectionHandler(Handler):
+
+    # drag a box around the figures to select; a click selects what is under
+    # the cursor or clears the selection
+    def __init__(self):
+        self.path = []
+
+    def mousePressed(self, sketch):
+        self.path = [sketch.getPressedPosition()]
+
+    def mouseMoved(self, sketch):
+        if self.path and sketch.isMousePressed():
+            self.extend(sketch.getCurrentPosition())
+            sketch.update(recount=False)
+
+    def extend(self, point: Point):
+        self.path[1:] = [point]
+
+    def dragged(self) -> bool:
+        # a region rather than a click
+        return len(self.path) > 1 and self.path[0].distToPoint(self.path[-1]) > 2
+
+    def polygon(self) -> list:
+        (x1, y1), (x2, y2) = self.path[0].coordinates, self.path[-1].coordinates
+        return [Point(x1, y1), Point(x2, y1), Point(x2, y2), Point(x1, y2)]
+
+    def mouseReleased(self, sketch):
+        if not self.path:
+            return
+        if self.dragged():
+            sketch.selectRegion(self.polygon())
+        else:
+            figure = sketch.pick()
+            sketch.select([figure] if figure else [])
+        self.path = []
+        sketch.update(recount=False)
+
+    def draw(self, painter):
+        if len(self.path) > 1:
+            painter.setPen(pen.band)
+            painter.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
+            painter.drawPolygon(QtGui.QPolygonF([toQtPoint(point) for point in self.polygon()]))
+
+
+class LassoHandler(SelectionHandler):
+
+    # the selection region follows the cursor freehand
+    def extend(self, point: Point):
+        self.path.append(point)
+
+    def dragged(self) -> bool:
+        # a lasso usually ends where it started, what counts is how far it went
+        if len(self.path) < 3:
+            return False
+        xs, ys = zip(*(point.coordinates for point in self.path))
+        return max(max(xs) - min(xs), max(ys) - min(ys)) > 2
+
+    def polygon(self) -> list:
+        return self.path
+
+
+class LineDrawing(Handler):
+
+    def __init__(self):
+        self.figures = set()
+
+    def mousePressed(self, sketch):
+        p1 = sketch.getPressedPosition()
+        p2 = sketch.getCurrentPosition()
+
+        line = Line(p1, p2)
+        sketch.addLine(line)
+        self.figures = {line, p1, p2}
+        sketch.update()
+
+    def mouseReleased(self, sketch):
+        self.cancel(sketch)
+
+    def cancel(self, sketch):
+        self.figures = set()
+
+    def moving(self, sketch) -> set:
+        return self.figures
+
+    def mouseMoved(self, sketch):
+        if sketch.isMousePressed():
+            p2 = sketch.lines[-1].p2
+            p2.x, p2.y = sketch.getCurrentPosition().coordinates
+            sketch.system.touch(p2)
+
+
+class PointDrawing(Handler):
+
+    def mousePressed(self, sketch):
+        point = sketch.getPressedPosition()
+        sketch.addPoint(point)
+        sketch.update()
+
+
+class ParallelHandler(Handler):
+
+    def __init__(self):
+        self.l1 = None
+
+    def mousePressed(self, sketch):
+        if not self.l1:
+            line = sketch.getActiveLine()
+            if line:
+                self.l1 = line
+        else:
+            l2 = sketch.getActiveLine()
+            if l2:
+                l1, self.l1 = self.l1, None
+                with sketch.transaction():
+                    for line in self.targets(sketch, l2):
+                        if line is not l1:
+                            sketch.addConstraint(Parallel(l1, line))
+
+
+class LengthHandler(Handler):
+
+    def __init__(self, length: float):
+        self.length = length
+
+    def mousePressed(self, sketch):
+        line = sketch.getActiveLine()
+        if line:
+            with sketch.transaction():
+                for line in self.targets(sketch, line):
+                    sketch.addConstraint(Length(line, self.length))
+
+
+class AngleHandler(Handler):
+
+    def __init__(self, angle: float):
+        self.angle = angle
+
+    def mousePressed(self, sketch):
+        line = sketch.getActiveLine()
+        if line:
+            with sketch.transaction():
+                for line in self.targets(sketch, line):
+                    sketch.addConstraint(Angle(line, self.angle))
+
+
+class FixingHandler(Handler):
+
+    def __init__(self, x: float, y: float):
+        self.x = x
+        self.y = y
+
+    def mousePressed(self, sketch):
+        point = sketch.getActivePoint()
+        if point:
+            with sketch.transaction():
+                sketch.addConstraint(FixingX(point, self.x))
+                sketch.addConstraint(FixingY(point, self.y))
+
+
+class VerticalHandler(Handler):
+
+    def mousePressed(self, sketch):
+        line = sketch.getActiveLine()
+        if line:
+            with sketch.transaction():
+                for line in self.targets(sketch, line):
+                    sketch.addConstraint(Vertical(line))
+
+
+class VerticalLineHandler(Handler):
+
+    def __init__(self):
+        self.p1 = None
+
+    def mousePressed(self, sketch):
+        if not self.p1:
+            self.p1 = Point(sketch.getPressedPosition().x, sketch.viewRect()[1])  # Set the first point to the top of the canvas
+
+    def mouseReleased(self, sketch):
+        if self.p1:
+            p2 = Point(self.p1.x, sketch.viewRect()[3])  # Set the second point to the bottom of the canvas
+            sketch.addLine(Line(self.p1, p2))
+            sketch.update()
+            self.p1 = None
+
+
+class HorizontalHandler(Handler):
+
+    def mousePressed(self, sketch):
+        line = sketch.getActiveLine()
+        if line:
+            with sketch.transaction():
+                for line in self.targets(sketch, line):
+                    sketch.addConstraint(Horizontal(line))
+
+
+class HorizontalLineHandler(Handler):
+
+    def __init__(self):
+        self.p1 = None
+
+    def mousePressed(self, sketch):
+        if not self.p1:
+            self.p1 = Point(sketch.viewRect()[0], sketch.getPressedPosition().y)  # Set the first point to the left edge of the canvas
+
+    def mouseReleased(self, sketch):
+        if self.p1:
+            p2 = Point(sketch.viewRect()[2], self.p1.y)  # Set the second point to the right edge of the canvas
+            sketch.addLine(Line(self.p1, p2))
+            sketch.update()
+            self.p1 = None
+
+
+class CircleDrawingHandler(Handler):
+    def __init__(self):
+        self.center = None
+        self.radius = 0.
+
+    def mousePressed(self, sketch):
+        if not self.center:
+            self.center = sketch.getPressedPosition()
+            self.radius = 0.
+
+    def mouseReleased(self, sketch):
+        if self.center:
+            radius = self.center.distToPoint(sketch.currentPos)
+            sketch.addCircle(Circle(self.center, radius))
+            sketch.update()
+            self.center = None
+
+    def mouseMoved(self, sketch):
+        if self.center:
+            self.radius = self.center.distToPoint(sketch.currentPos)
+            sketch.update()
+
+    def draw(self, painter):
+        if self.center:
+            painter.setPen(pen.line)
+            painter.setBrush(QtGui.QBrush(QtGui.QColor(0, 0, 0, 0)))  # Transparent fill
+            painter.drawEllipse(toQtPoint(self.center), self.radius, self.radius)
+
+
+class EraserHandler(Handler):
+
+    def __init__(self):
+        self.selected_object = None
+
+    def getActiveLine(self, sketch):
+        return sketch.getActiveLine() or None
+
+    def mousePressed(self, sketch):
+        self.selected_object = self.getActiveLine(sketch)
+
+    def mouseReleased(self, sketch):
+        if self.selected_object:
+            if self.selected_object in sketch.selection:
+                # erasing one selected figure erases the whole selection
+                sketch.removeSelection()
+            else:
+                sketch.removeLine(self.selected_object)
+            self.selected_object = None
+
+    def mouseMoved(self, sketch):
+        pass  # Implement this if needed
+
+
+class MoveObjectHandler(Handler):
+    def __init__(self):
+        self.selected_object = None
+        self.offset = Point(0, 0)
+        self.points = []
+        self.figures = None
+
+    def mousePressed(self, sketch):
+        if not self.selected_object:
+            # a point under the cursor wins over the line it sits on
+            line = sketch.getActiveLine()
+            if line:
+                self.selected_object = line
+                self.offset = Point(sketch.currentPos.x - line.p1.x, sketch.currentPos.y - line.p1.y)
+            point = sketch.getActivePoint()
+            if point:
+                self.selected_object = point
+                self.offset = Point(0, 0)
+            if self.selected_object:
+                # dragging a selected figure drags the whole selection
+                figures = sketch.selection if self.selected_object in sketch.selection else [self.selected_object]
+                self.points = []
+                for figure in figures:
+                    if isinstance(figure, Line):
+                        self.points.extend(figure.points)
+                    elif isinstance(figure, Circle):
+                        self.points.append(figure.center)
+                    else:
+                        self.points.append(figure)
+                sketch.system.beginDrag()
+
+    def mouseReleased(self, sketch):
+        self.cancel(sketch)
+
+    def cancel(self, sketch):
+        # the drag ends however the gesture does, the solver would stay relaxed
+        if self.selected_object:
+            sketch.system.endDrag()
+            sketch.update()
+        self.selected_object = None
+        self.points = []
+        self.figures = None
+
+    def moving(self, sketch) -> set:
+        # the dragged points, those the solver moves with them and every line
+        # and circle on any of them
+        if not self.selected_object:
+            return set()
+        if self.figures is None:
+            points = sketch.system.connected(self.points)
+            self.figures = set(points)
+            for point in points:
+                self.figures.update(sketch.drawing.index.incident.get(point, ()))
+        return self.figures
+
+    def mouseMoved(self, sketch):
+        if self.selected_object:
+            new_pos = Point(sketch.currentPos.x - self.offset.x, sketch.currentPos.y - self.offset.y)
+            anchor = self.selected_object.p1 if isinstance(self.selected_object, Line) else self.selected_object
+            delta_x = new_pos.x - anchor.x
+            delta_y = new_pos.y - anchor.y
+            # move the points in place so constraints keep referring to them,
+            # all in one write and one solve
+            sketch.drawing.translate(self.points, delta_x, delta_y)
+            sketch.update()
+
+
+class CoincidentHandler(Handler):
+
+    def __init__(self):
+        self.p1 = None
+
+    def mousePressed(self, sketch):
+        point = sketch.getActivePoint()
+        if point:
+            if not self.p1:
+                self.p1 = point
+                return True
+            else:
+                # one shared vertex instead of a pair of constraints
+                sketch.weld(self.p1, point)
+
+                self.p1 = None
+                sketch.update()
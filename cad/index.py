@@ -0,0 +1,343 @@
+import math
+
+import numpy as np
+
+from cad.figures import *
+
+
+# distances from (x, y) to many figures at once, one numpy pass per kind
+
+def pointDistances(points: np.ndarray, x: float, y: float) -> np.ndarray:
+    return np.hypot(points[:, 0] - x, points[:, 1] - y)
+
+
+def segmentDistances(segments: np.ndarray, x: float, y: float) -> np.ndarray:
+    x1, y1, x2, y2 = segments.T
+    dx, dy = x2 - x1, y2 - y1
+    lengths = dx * dx + dy * dy
+    # projection onto each segment, clamped to its endpoints
+    t = ((x - x1) * dx + (y - y1) * dy) / np.where(lengths == 0., 1., lengths)
+    t = np.clip(t, 0., 1.)
+    return np.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+
+def circleDistances(circles: np.ndarray, x: float, y: float) -> np.ndarray:
+    # to the outline, rows of (x, y, radius)
+    return np.abs(np.hypot(circles[:, 0] - x, circles[:, 1] - y) - circles[:, 2])
+
+
+def insidePolygon(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    # even-odd rule, one pass over all the points per edge of the polygon
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edge = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x < edge)
+        x1, y1 = x2, y2
+    return inside
+
+
+class Grid(object):
+
+    # figures crossing more cells than this are kept out of the bins and
+    # tested by their bounding box on every query
+    limit = 64
+
+    # uniform grid over the drawing for hit testing: every cell holds the
+    # lines, vertices and circle outlines passing through it, so a pick only
+    # looks at the few cells around the cursor. coordinates written to the
+    # store are picked up from its moved slots before each query. the cell
+    # size follows the scale of the data, drawings come in any unit
+    def __init__(self, store, size: float = 32.):
+        self.store = store
+        self.size = size
+        # entries when the size was last derived from the data
+        self.fitted = 0
+
+        self.cells = {}
+        self.long = set()
+        # entity -> (cells, points it was binned from)
+        self.entries = {}
+        # vertices are shared by lines and free points, counted to know when
+        # one leaves the index
+        self.references = {}
+        # point -> lines and circles to rebin when it moves
+        self.incident = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def cell(self, x: float, y: float) -> tuple:
+        return math.floor(x / self.size), math.floor(y / self.size)
+
+    def cellsOf(self, entity) -> list:
+        # None for figures too large to bin
+        size = self.size
+        if isinstance(entity, Point):
+            return [self.cell(*entity.coordinates)]
+
+        if isinstance(entity, Circle):
+            x, y = entity.center.coordinates
+            r = entity.radius
+            if 2 * math.pi * r > self.limit * size:
+                return None
+            (i1, j1), (i2, j2) = self.cell(x - r, y - r), self.cell(x + r, y + r)
+            cells = []
+            for i in range(i1, i2 + 1):
+                for j in range(j1, j2 + 1):
+                    # only the cells the outline crosses
+                    dx = max(i * size - x, 0., x - (i + 1) * size)
+                    dy = max(j * size - y, 0., y - (j + 1) * size)
+                    fx = max(abs(i * size - x), abs((i + 1) * size - x))
+                    fy = max(abs(j * size - y), abs((j + 1) * size - y))
+                    if math.hypot(dx, dy) <= r <= math.hypot(fx, fy):
+                        cells.append((i, j))
+            return cells
+
+        x1, y1, x2, y2 = entity.coordinates()
+        if abs(x2 - x1) + abs(y2 - y1) > self.limit * size:
+            return None
+        if x2 < x1:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        cells = []
+        for i in range(math.floor(x1 / size), math.floor(x2 / size) + 1):
+            # the piece of the segment inside this column of cells
+            left, right = max(x1, i * size), min(x2, (i + 1) * size)
+            if x2 > x1:
+                slope = (y2 - y1) / (x2 - x1)
+                ya, yb = y1 + (left - x1) * slope, y1 + (right - x1) * slope
+            else:
+                ya, yb = y1, y2
+            for j in range(math.floor(min(ya, yb) / size), math.floor(max(ya, yb) / size) + 1):
+                cells.append((i, j))
+        return cells
+
+    def insert(self, entity, points: tuple):
+        cells = self.cellsOf(entity)
+        if cells is None:
+            self.long.add(entity)
+            cells = ()
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(entity)
+        self.entries[entity] = cells, points
+
+    def discard(self, entity) -> tuple:
+        cells, points = self.entries.pop(entity)
+        self.long.discard(entity)
+        for cell in cells:
+            content = self.cells[cell]
+            content.discard(entity)
+            if not content:
+                del self.cells[cell]
+        return points
+
+    def addPoint(self, point: Point):
+        if point not in self.references:
+            self.references[point] = 0
+            self.insert(point, (point,))
+            self.grow()
+        self.references[point] += 1
+
+    def removePoint(self, point: Point):
+        self.references[point] -= 1
+        if not self.references[point]:
+            del self.references[point]
+            self.discard(point)
+
+    def addLine(self, line: Line):
+        self.insert(line, line.points)
+        for point in line.points:
+            self.addPoint(point)
+            self.incident.setdefault(point, set()).add(line)
+        self.grow()
+
+    def removeLine(self, line: Line):
+        for point in self.discard(line):
+            self.removePoint(point)
+            self.unlink(point, line)
+
+    def addCircle(self, circle: Circle):
+        self.insert(circle, (circle.center,))
+        self.incident.setdefault(circle.center, set()).add(circle)
+        self.grow()
+
+    def removeCircle(self, circle: Circle):
+        for point in self.discard(circle):
+            self.unlink(point, circle)
+
+    def unlink(self, point: Point, entity):
+        entities = self.incident[point]
+        entities.discard(entity)
+        if not entities:
+            del self.incident[point]
+
+    def update(self, entity):
+        # after an endpoint was swapped for another point
+        if isinstance(entity, Line):
+            self.removeLine(entity)
+            self.addLine(entity)
+        else:
+            self.removeCircle(entity)
+            self.addCircle(entity)
+
+    def rebin(self, entity):
+        points = self.discard(entity)
+        self.insert(entity, points)
+
+    def grow(self):
+        # the size is derived again each time the drawing doubles
+        if len(self.entries) >= 2 * max(self.fitted, 32):
+            self.fit()
+
+    def fit(self):
+        # cells about as large as the median line, but not much finer than
+        # the mean spacing of the vertices, which sizes them without lines
+        self.fitted = len(self.entries)
+        store = self.store
+        vertices = store.coordinates[store.points.rows]
+        if not len(vertices):
+            return
+        width, height = (vertices.max(axis=0) - vertices.min(axis=0)).tolist()
+        spacing = max((width * height / len(vertices)) ** .5, max(width, height) / len(vertices))
+        segments = store.segments()[1]
+        if len(segments):
+            lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+            size = max(float(np.median(lengths)), spacing / 16)
+        else:
+            size = spacing
+        # rebinning everything only pays off for a real change of scale
+        if size > 0. and not .5 <= size / self.size <= 2.:
+            self.resize(size)
+
+    def resize(self, size: float):
+        self.size = size
+        self.cells.clear()
+        self.long.clear()
+        for entity, (cells, points) in list(self.entries.items()):
+            self.insert(entity, points)
+
+    def sync(self):
+        if not self.store.moved:
+            return
+        slots, self.store.moved = self.store.moved, set()
+
+        entities = set()
+        for slot in slots:
+            point = self.store.points.entities[slot]
+            if point is None:
+                continue
+            if point in self.references:
+                entities.add(point)
+            entities.update(self.incident.get(point, ()))
+        for entity in entities:
+            self.rebin(entity)
+
+    def region(self, x1: float, y1: float, x2: float, y2: float) -> set:
+        # everything binned in the cells overlapping the rectangle
+        self.sync()
+        (i1, j1), (i2, j2) = self.cell(x1, y1), self.cell(x2, y2)
+        found = {entity for entity in self.long if self.overlaps(entity, x1, y1, x2, y2)}
+        if (i2 - i1 + 1) * (j2 - j1 + 1) > len(self.cells):
+            # a rectangle over most of the drawing, walk the cells in use
+            for (i, j), content in self.cells.items():
+                if i1 <= i <= i2 and j1 <= j <= j2:
+                    found.update(content)
+            return found
+        for i in range(i1, i2 + 1):
+            for j in range(j1, j2 + 1):
+                found.update(self.cells.get((i, j), ()))
+        return found
+
+    @staticmethod
+    def overlaps(entity, x1: float, y1: float, x2: float, y2: float) -> bool:
+        # bounding box test for the figures outside the bins
+        if isinstance(entity, Circle):
+            x, y = entity.center.coordinates
+            r = entity.radius
+            return x - r <= x2 and x + r >= x1 and y - r <= y2 and y + r >= y1
+        a, b, c, d = entity.coordinates()
+        return min(a, c) <= x2 and max(a, c) >= x1 and min(b, d) <= y2 and max(b, d) >= y1
+
+    def near(self, point: Point, radius: float) -> set:
+        # candidates for an exact distance test
+        x, y = point.coordinates
+        return self.region(x - radius, y - radius, x + radius, y + radius)
+
+    def inside(self, polygon) -> set:
+        # figures entirely inside the polygon: points, lines with both ends
+        # and circles by their center
+        polygon = np.asarray(polygon, dtype=float)
+        if len(polygon) < 3:
+            return set()
+        (x1, y1), (x2, y2) = polygon.min(axis=0), polygon.max(axis=0)
+        candidates = self.region(x1, y1, x2, y2)
+        if not candidates:
+            return set()
+        lines = [figure for figure in candidates if isinstance(figure, Line)]
+        points = [figure for figure in candidates if isinstance(figure, Point)]
+        circles = [figure for figure in candidates if isinstance(figure, Circle)]
+
+        # the slots of the points each candidate needs inside, looked up in
+        # the tables of the store
+        store = self.store
+        rows = np.fromiter((line.row for line in lines), dtype=int, count=len(lines))
+        centers = np.fromiter((circle.row for circle in circles), dtype=int, count=len(circles))
+        ends = np.concatenate([
+            store.lines.data[rows],
+            np.fromiter((point.slot for point in points), dtype=int, count=len(points)).repeat(2).reshape(-1, 2),
+            store.circles.data['center'][centers].repeat(2).reshape(-1, 2),
+        ])
+
+        # every point is tested once
+        slots = np.unique(ends)
+        inside = np.zeros(store.points.size, dtype=bool)
+        inside[slots] = insidePolygon(store.coordinates[slots], polygon)
+
+        figures = lines + points + circles
+        return {figures[i] for i in np.flatnonzero(inside[ends].all(axis=1))}
+
+    def distances(self, kind, figures: list, x: float, y: float) -> np.ndarray:
+        store = self.store
+        if issubclass(kind, Line):
+            return segmentDistances(store.segmentsOf(figures), x, y)
+        if issubclass(kind, Point):
+            slots = np.fromiter((point.slot for point in figures), dtype=int, count=len(figures))
+            return pointDistances(store.coordinates[slots], x, y)
+        circles = np.array([circle.center.coordinates + (circle.radius,) for circle in figures])
+        return circleDistances(circles, x, y)
+
+    def nearestOfEach(self, point: Point, tolerances: tuple) -> dict:
+        # closest figure of every kind that has one within its tolerance,
+        # tolerances are (kind, distance) pairs
+        candidates = self.near(point, max(tolerance for kind, tolerance in tolerances))
+        x, y = point.coordinates
+        found = {}
+        for kind, tolerance in tolerances:
+            figures = [figure for figure in candidates if isinstance(figure, kind)]
+            if not figures:
+                continue
+            distances = self.distances(kind, figures, x, y)
+            i = int(np.argmin(distances))
+            if distances[i] < tolerance:
+                found[kind] = figures[i]
+        return found
+
+    def nearest(self, point: Point, tolerances: tuple):
+        # closest figure of the first kind that has one, from the most to the
+        # least wanted
+        found = self.nearestOfEach(point, tolerances)
+        for kind, tolerance in tolerances:
+            if kind in found:
+                return found[kind]
+        return None
+
+    def clear(self):
+        self.fitted = 0
+        self.cells.clear()
+        self.long.clear()
+        self.entries.clear()
+        self.references.clear()
+        self.incident.clear()
@@ -14,3 +14,16 @@ point = QPen(line.color(), WIDTH * 2, line.style())
 
 activeLine = QPen(ACTIVE_COLOR, ACTIVE_WIDTH, ACTIVE_STYLE)
 activePoint = QPen(ACTIVE_COLOR, ACTIVE_WIDTH * 2, ACTIVE_STYLE)
+
+SELECTED_COLOR = Qt.blue
+
+selectedLine = QPen(SELECTED_COLOR, WIDTH + 1, STYLE)
+selectedPoint = QPen(SELECTED_COLOR, WIDTH * 3, STYLE)
+
+# outline of a box or lasso being dragged
+band = QPen(Qt.darkGray, 1, Qt.DashLine)
+
+# widths are in pixels of the screen, whatever the zoom of the sketch
+for cosmetic in (line, point, activeLine, activePoint, selectedLine, selectedPoint, band):
+    cosmetic.setCosmetic(True)
+del cosmetic
@@ -0,0 +1,64 @@
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtCore import QPointF, QLineF, QRect, QRectF
+from PyQt5.QtGui import QPolygonF
+
+from cad.figures import *
+
+
+# conversions between the geometry and Qt, only used where it is painted
+
+def toQtPoint(point: Point) -> QPointF:
+    return QPointF(point.x, point.y)
+
+
+def fromQtPoint(point: QPointF) -> Point:
+    return Point(point.x(), point.y())
+
+
+def toQtLine(line: Line) -> QLineF:
+    return QLineF(toQtPoint(line.p1), toQtPoint(line.p2))
+
+
+def fromQtLine(line: QLineF) -> Line:
+    return Line(fromQtPoint(line.p1()), fromQtPoint(line.p2()))
+
+
+def toQtRect(circle: Circle) -> QRect:
+    # Calculate integer coordinates for the rectangle
+    x = int(circle.center.x - circle.radius)
+    y = int(circle.center.y - circle.radius)
+    width = int(2 * circle.radius)
+    height = int(2 * circle.radius)
+
+    # Create and return a QRect object
+    return QRect(x, y, width, height)
+
+
+# whole arrays at once, for the bulk drawLines and drawPoints overloads. the
+# coordinates are copied straight into the memory of the Qt arrays, which
+# hold plain doubles
+
+def toQtLines(segments: np.ndarray):
+    if not hasattr(sip, 'array'):
+        # older sip has no arrays of Qt values
+        return [QLineF(x1, y1, x2, y2) for x1, y1, x2, y2 in segments.tolist()]
+    lines = sip.array(QLineF, len(segments))
+    if len(segments):
+        np.frombuffer(memoryview(lines).cast('B'), dtype=float).reshape(-1, 4)[:] = segments
+    return lines
+
+
+def toQtPoints(points: np.ndarray) -> QPolygonF:
+    polygon = QPolygonF(len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(len(points) * 2 * np.dtype(float).itemsize)
+        np.frombuffer(buffer, dtype=float).reshape(-1, 2)[:] = points
+    return polygon
+
+
+def toQtRects(circles: np.ndarray) -> list:
+    # bounding rectangles of (x, y, radius) rows, kept in floats so circles
+    # stay round when zoomed in
+    return [QRectF(x - r, y - r, 2 * r, 2 * r) for x, y, r in circles.tolist()]
@@ -1,39 +1,240 @@
+import threading
+from contextlib import contextmanager
+
+import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from cad.solver import *
+from cad.handlers import DisableHandler
+from cad.drawing import Drawing
+from cad.render import *
 from cad import pen
 
 
+class SolverThread(QtCore.QThread):
+
+    solved = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, system: System, *args):
+        super().__init__(*args)
+        self.system = system
+
+        self.condition = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.stopped = False
+
+    def submit(self, job: Job):
+        with self.condition:
+            # latest wins, an older job that has not started is dropped
+            self.pending = job
+            self.condition.notify()
+
+    def take(self) -> Job:
+        # withdraws the job waiting to start, if any
+        with self.condition:
+            job, self.pending = self.pending, None
+            return job
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.wait()
+
+    @property
+    def idle(self) -> bool:
+        with self.condition:
+            return self.pending is None and not self.busy
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                job, self.pending = self.pending, None
+                self.busy = True
+
+            results = self.system.compute(job)
+
+            with self.condition:
+                self.busy = False
+            self.solved.emit(job, results)
+
+
 class Sketch(QtWidgets.QWidget):
 
+    solvingChanged = QtCore.pyqtSignal(bool)
+    solved = QtCore.pyqtSignal(object)
+    constraintRejected = QtCore.pyqtSignal(str)
+
+    # how close the cursor has to be to a figure to pick it, in pixels
+    tolerances = ((Point, 4.), (Line, 2.), (Circle, 2.))
+
+    # limits of the zoom and the margin left around the drawing by fit
+    minScale = 1e-4
+    maxScale = 1e4
+    fitMargin = 20
+
     def __init__(self, *args):
         super().__init__(*args)
 
-        self.lines = []
-        self.points = []
-        self.circles = []
+        self.drawing = Drawing()
         self.currentPos = None
         self.pressedPos = None
 
+        # a drawing position is shown at position * viewScale + viewOffset;
+        # currentPos and pressedPos are drawing positions
+        self.viewScale = 1.
+        self.viewOffset = 0., 0.
+        self.cursor = None
+        self.panning = None
+        self.hoverKey = None
+        self.hovered = {}
+
+        # figures the handlers act on together
+        self.selection = set()
+        self.selectionRevision = 0
+
+        # the committed geometry painted once into a pixmap, repainted when
+        # the model, the selection or the widget changes
+        self.layer = None
+        self.layerKey = None
+        # the Qt arrays it is painted from, converted once per model state
+        self.geometry = None
+        self.geometryKey = None
+
+        self._handler = None
         self.handler = DisableHandler()
-        self.system = System(self)
+
+        # solve on a worker thread so a slow recount never blocks the GUI
+        self.asynchronous = True
+        self.solving = False
+        self.transactions = 0
+        self.solver = SolverThread(self.system, self)
+        self.solver.solved.connect(self.applySolution)
+        self.solver.start()
+        # the thread has to finish before Qt deletes it, however the widget or
+        # the application goes away
+        self.destroyed.connect(self.solver.stop)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.solver.stop)
 
         self.setMouseTracking(True)
         self.setWindowTitle('PIXOR-Cad')
 
+    @property
+    def handler(self):
+        return self._handler
+
+    @handler.setter
+    def handler(self, handler):
+        # the tool being left winds down what it started
+        if self._handler is not None:
+            self._handler.cancel(self)
+        self._handler = handler
+
+    @property
+    def lines(self) -> list:
+        return self.drawing.lines
+
+    @property
+    def points(self) -> list:
+        return self.drawing.points
+
+    @property
+    def circles(self) -> list:
+        return self.drawing.circles
+
+    @property
+    def system(self) -> System:
+        return self.drawing.system
+
     def addLine(self, line: Line):
-        self.lines.append(line)
+        self.drawing.addLine(line)
+
+    def removeLine(self, line: Line):
+        self.deselect(line)
+        self.drawing.removeLine(line)
 
     def addCircle(self, circle: Circle):
-        self.circles.append(circle)
+        self.drawing.addCircle(circle)
 
     def drawCircles(self, painter):
-        for circle in self.circles:
-            painter.setPen(pen.activeLine)
-            painter.drawEllipse(circle.toQtRect())
+        painter.setPen(pen.activeLine)
+        for rect in self.qtGeometry()[2]:
+            painter.drawEllipse(rect)
+
+    def addConstraint(self, constraint) -> bool:
+        try:
+            self.drawing.addConstraint(constraint)
+        except ConstraintError as e:
+            self.constraintRejected.emit(str(e))
+            return False
+        return True
+
+    @contextmanager
+    def transaction(self):
+        # one constraint check, recount and repaint for everything done inside
+        self.transactions += 1
+        try:
+            with self.system.transaction():
+                yield self
+        except ConstraintError as e:
+            self.constraintRejected.emit(str(e))
+        finally:
+            self.transactions -= 1
+            if not self.transactions:
+                self.update()
+
+    def weld(self, p1: Point, p2: Point) -> bool:
+        try:
+            self.drawing.weld(p1, p2)
+        except ConstraintError as e:
+            self.constraintRejected.emit(str(e))
+            return False
+        return True
+
+    def unweld(self, point: Point):
+        self.drawing.unweld(point)
 
     def addPoint(self, point: Point):
-        self.points.append(point)
+        self.drawing.addPoint(point)
+
+    def removePoint(self, point: Point):
+        self.deselect(point)
+        self.drawing.removePoint(point)
+
+    def select(self, figures, extend: bool = False):
+        if not extend:
+            self.clearSelection()
+        self.selection.update(figures)
+        for figure in self.selection:
+            if isinstance(figure, Circle):
+                figure.select()
+        self.selectionRevision += 1
+
+    def deselect(self, figure):
+        if figure in self.selection:
+            self.selection.discard(figure)
+            self.selectionRevision += 1
+
+    def clearSelection(self):
+        for figure in self.selection:
+            if isinstance(figure, Circle):
+                figure.deselect()
+        self.selection.clear()
+        self.selectionRevision += 1
+
+    def selectRegion(self, polygon: list, extend: bool = False):
+        # a box is a polygon of its four corners
+        self.select(self.drawing.index.inside([point.coordinates for point in polygon]), extend)
+
+    def removeSelection(self):
+        self.drawing.remove(self.selection)
+        self.selection.clear()
+        self.selectionRevision += 1
 
     def isMousePressed(self) -> bool:
         return self.pressedPos is not None
@@ -44,43 +245,114 @@ class Sketch(QtWidgets.QWidget):
     def getPressedPosition(self) -> Point:
         return self.pressedPos
 
-    def getActiveLine(self):
-        for line in self.lines:
-            if line.hasPoint(self.currentPos, 4):
-                return line
+    def hover(self) -> dict:
+        # the closest figure of each kind under the cursor, resolved once per
+        # cursor position and model state however often handlers, painting
+        # and key presses ask for it
+        key = self.currentPos.coordinates, self.system.revision, self.drawing.store.version, self.viewScale
+        if key != self.hoverKey:
+            self.hoverKey = key
+            # the tolerances stay in pixels
+            tolerances = [(kind, tolerance / self.viewScale) for kind, tolerance in self.tolerances]
+            self.hovered = self.drawing.index.nearestOfEach(self.currentPos, tolerances)
+        return self.hovered
+
+    def pick(self, kinds: tuple = None):
+        # a vertex wins over the line it ends and a line over a circle
+        if self.currentPos is None:
+            return False
+        hovered = self.hover()
+        for kind, tolerance in self.tolerances:
+            if kind in hovered and (kinds is None or kind in kinds):
+                return hovered[kind]
         return False
 
+    def getActiveLine(self):
+        return self.pick((Line,))
+
     def getActivePoint(self):
-        for line in self.lines:
-            for point in line.points:
-                if point.distToPoint(self.currentPos) < 4:
-                    return point
-        for point in self.points:
-            if point.distToPoint(self.currentPos) < 4:
-                return point
-        return False
+        return self.pick((Point,))
 
     def keyPressEvent(self, event):
         keys = [QtCore.Qt.Key_Backspace, QtCore.Qt.Key_Delete]
 
         if event.key() in keys:
-            self.removeSelectedFigure()
+            if self.selection:
+                self.removeSelection()
+            else:
+                self.removeSelectedFigure()
 
         self.update()
 
     def removeSelectedFigure(self):
         line = self.getActiveLine()
         if line:
-            self.lines.remove(line)
+            self.removeLine(line)
             return True
 
         point = self.getActivePoint()
         if point:
-            self.points.remove(point)
+            self.removePoint(point)
+
+    def transform(self) -> QtGui.QTransform:
+        x, y = self.viewOffset
+        return QtGui.QTransform(self.viewScale, 0, 0, self.viewScale, x, y)
+
+    def fromView(self, position: QtCore.QPointF) -> Point:
+        x, y = self.viewOffset
+        return Point((position.x() - x) / self.viewScale, (position.y() - y) / self.viewScale)
+
+    def viewRect(self) -> tuple:
+        # (x1, y1, x2, y2) of the drawing that is visible
+        p1 = self.fromView(QtCore.QPointF(0, 0))
+        p2 = self.fromView(QtCore.QPointF(self.width(), self.height()))
+        return p1.x, p1.y, p2.x, p2.y
+
+    def setView(self, scale: float, offset: tuple):
+        self.viewScale = min(max(scale, self.minScale), self.maxScale)
+        self.viewOffset = offset
+        # the cursor stays where it is on the screen, over another position
+        if self.cursor is not None:
+            self.currentPos = self.fromView(self.cursor)
+        super().update()
+
+    def zoom(self, factor: float, anchor: QtCore.QPointF = None):
+        # the drawing position under the anchor stays under it
+        if anchor is None:
+            anchor = QtCore.QPointF(self.width() / 2, self.height() / 2)
+        scale = min(max(self.viewScale * factor, self.minScale), self.maxScale)
+        factor = scale / self.viewScale
+        x, y = self.viewOffset
+        self.setView(scale, (anchor.x() - (anchor.x() - x) * factor, anchor.y() - (anchor.y() - y) * factor))
+
+    def pan(self, dx: float, dy: float):
+        x, y = self.viewOffset
+        self.setView(self.viewScale, (x + dx, y + dy))
+
+    def fit(self):
+        # zoom to the extents of the drawing, back to the identity when empty
+        extents = self.drawing.extents()
+        if extents is None:
+            return self.setView(1., (0., 0.))
+        x1, y1, x2, y2 = extents
+        width = max(self.width() - 2 * self.fitMargin, 1)
+        height = max(self.height() - 2 * self.fitMargin, 1)
+        scale = min(width / max(x2 - x1, 1e-9), height / max(y2 - y1, 1e-9))
+        scale = min(max(scale, self.minScale), self.maxScale)
+        self.setView(scale, (self.width() / 2 - (x1 + x2) / 2 * scale, self.height() / 2 - (y1 + y2) / 2 * scale))
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.zoom(1.25 ** steps, event.posF())
 
     def mousePressEvent(self, event):
         position = event.localPos()
-        self.pressedPos = Point.fromQtPoint(position)
+        if event.button() == QtCore.Qt.MiddleButton:
+            # the middle button drags the view, not the drawing
+            self.panning = position
+            return
+        self.pressedPos = self.fromView(position)
 
         # Check if the user clicked on an object to erase it
         '''if event.button() == QtCore.Qt.LeftButton:
@@ -94,10 +366,13 @@ class Sketch(QtWidgets.QWidget):
         # Check if the user clicked on a line to remove it
         line = self.getActiveLine()
         if line:
-            self.lines.remove(line)
+            self.removeLine(line)
             return True
-        
+
     def mouseReleaseEvent(self, event):
+        if event.button() == QtCore.Qt.MiddleButton:
+            self.panning = None
+            return
         if event.button() == QtCore.Qt.LeftButton:
             self.pressedPos = None
 
@@ -105,50 +380,183 @@ class Sketch(QtWidgets.QWidget):
 
     def mouseMoveEvent(self, event):
         position = event.localPos()
-        self.currentPos = Point.fromQtPoint(position)
+        if self.panning is not None:
+            delta = position - self.panning
+            self.panning = position
+            self.cursor = position
+            return self.pan(delta.x(), delta.y())
+        self.cursor = position
+        self.currentPos = self.fromView(position)
 
         self.handler.mouseMoved(self)
         self.update()
 
     def update(self, recount=True):
-        if recount:
-            self.system.recount()
+        if self.transactions:
+            return
+
+        # the system only re-solves when the model changed since the last recount
+        if recount and self.system.dirty:
+            if self.asynchronous:
+                # a job that has not started yet is folded into the new one
+                waiting = self.solver.take()
+                if waiting is not None:
+                    self.system.retry(waiting)
+                self.solver.submit(self.system.prepare())
+                self.setSolving(True)
+            else:
+                self.system.recount()
+                self.solved.emit(self.system.stats)
 
         super().update()
 
+    def applySolution(self, job: Job, results: list):
+        # results of an edit that has since been superseded are dropped
+        self.system.apply(job, results)
+        self.solved.emit(job.stats)
+
+        if self.system.dirty:
+            self.update()
+        elif self.solver.idle:
+            self.setSolving(False)
+        super().update()
+
+    def setSolving(self, solving: bool):
+        if self.solving != solving:
+            self.solving = solving
+            self.solvingChanged.emit(solving)
+
+    def shutdown(self):
+        self.solver.stop()
+
     def paintEvent(self, event):
         painter = QtGui.QPainter()
         painter.begin(self)
-        self.drawLines(painter)
-        self.drawPoints(painter)
-        self.drawCircles(painter)
+        painter.drawPixmap(0, 0, self.staticLayer())
+        # only the hover highlight and what the handler is doing are painted
+        # on every frame
+        painter.setTransform(self.transform())
+        self.drawMoving(painter)
         self.drawActive(painter)
+        self.handler.draw(painter)
         painter.end()
 
+    def modelKey(self):
+        # while a gesture moves figures on every frame the layer leaves them
+        # out and keeps the rest as it was when the gesture started
+        moving = self.handler.moving(self)
+        if moving:
+            return moving
+        return self.system.revision, self.drawing.store.version
+
+    def staticLayer(self) -> QtGui.QPixmap:
+        ratio = self.devicePixelRatioF()
+        key = (self.modelKey(), self.selectionRevision,
+               self.width(), self.height(), ratio, self.viewScale, self.viewOffset)
+        if key != self.layerKey:
+            self.layerKey = key
+            self.layer = QtGui.QPixmap(self.size() * ratio)
+            self.layer.setDevicePixelRatio(ratio)
+            self.layer.fill(QtCore.Qt.transparent)
+
+            painter = QtGui.QPainter()
+            painter.begin(self.layer)
+            painter.setTransform(self.transform())
+            self.drawLines(painter)
+            self.drawPoints(painter)
+            self.drawCircles(painter)
+            self.drawSelection(painter)
+            painter.end()
+        return self.layer
+
+    def culled(self) -> tuple:
+        # the visible rectangle, widened by the width of the widest pen
+        x1, y1, x2, y2 = self.viewRect()
+        margin = 10 / self.viewScale
+        return x1 - margin, y1 - margin, x2 + margin, y2 + margin
+
+    def qtGeometry(self) -> tuple:
+        # the visible lines, vertices and free points, and circle rectangles
+        # as Qt types, converted once per model state and view
+        rect = self.culled()
+        key = self.modelKey(), rect
+        if key != self.geometryKey:
+            segments, vertices, circles = self.drawing.visible(*rect, excluded=self.handler.moving(self))
+            self.geometryKey = key
+            self.geometry = toQtLines(segments), toQtPoints(vertices), toQtRects(circles)
+        return self.geometry
+
     def drawLines(self, painter):
-        for line in self.lines:
-            painter.setPen(pen.line)
-            painter.drawLine(line.toQtLine())
-            painter.setPen(pen.point)
-            painter.drawPoint(line.p1.toQtPoint())
-            painter.drawPoint(line.p2.toQtPoint())
+        painter.setPen(pen.line)
+        painter.drawLines(self.qtGeometry()[0])
 
     def drawPoints(self, painter):
-        for point in self.points:
+        # the vertices of the lines and the free points
+        painter.setPen(pen.point)
+        painter.drawPoints(self.qtGeometry()[1])
+
+    def drawMoving(self, painter):
+        # the figures of a gesture in progress, left out of the layer
+        moving = self.handler.moving(self)
+        if not moving:
+            return
+        store = self.drawing.store
+        lines = [figure for figure in moving if isinstance(figure, Line)]
+        points = [figure for figure in moving if isinstance(figure, Point)]
+        circles = [figure for figure in moving if isinstance(figure, Circle)]
+        if lines:
+            segments = store.segmentsOf(lines)
+            painter.setPen(pen.line)
+            painter.drawLines(toQtLines(segments))
             painter.setPen(pen.point)
-            painter.drawPoint(point.toQtPoint())
+            painter.drawPoints(toQtPoints(segments.reshape(-1, 2)))
+        if points:
+            painter.setPen(pen.point)
+            painter.drawPoints(toQtPoints(np.array([point.coordinates for point in points])))
+        if circles:
+            painter.setPen(pen.activeLine)
+            for rect in toQtRects(np.array([circle.center.coordinates + (circle.radius,) for circle in circles])):
+                painter.drawEllipse(rect)
+        self.drawSelection(painter, moving & self.selection)
+
+    def drawSelection(self, painter, figures: set = None):
+        # the layer highlights the selection but for what a gesture moves
+        if figures is None:
+            figures = self.selection - self.handler.moving(self)
+        store = self.drawing.store
+        x1, y1, x2, y2 = self.culled()
+        lines = [figure for figure in figures if isinstance(figure, Line)]
+        points = [figure for figure in figures if isinstance(figure, Point)]
+        circles = [figure for figure in figures if isinstance(figure, Circle)]
+        if lines:
+            segments = store.segmentsOf(lines)
+            lows = np.minimum(segments[:, :2], segments[:, 2:])
+            highs = np.maximum(segments[:, :2], segments[:, 2:])
+            segments = segments[(lows[:, 0] <= x2) & (highs[:, 0] >= x1) & (lows[:, 1] <= y2) & (highs[:, 1] >= y1)]
+            painter.setPen(pen.selectedLine)
+            painter.drawLines(toQtLines(segments))
+        if points:
+            vertices = np.array([point.coordinates for point in points])
+            vertices = vertices[(vertices[:, 0] >= x1) & (vertices[:, 0] <= x2) &
+                                (vertices[:, 1] >= y1) & (vertices[:, 1] <= y2)]
+            painter.setPen(pen.selectedPoint)
+            painter.drawPoints(toQtPoints(vertices))
+        if circles:
+            painter.setPen(pen.selectedLine)
+            for rect in toQtRects(np.array([circle.center.coordinates + (circle.radius,) for circle in circles])):
+                painter.drawEllipse(rect)
 
     def drawActive(self, painter):
         point = self.getActivePoint()
         if point:
             painter.setPen(pen.activePoint)
-            painter.drawPoint(point.toQtPoint())
+            painter.drawPoint(toQtPoint(point))
             return True
 
         line = self.getActiveLine()
         if line:
             painter.setPen(pen.activeLine)
-            painter.drawLine(line.toQtLine())
+            painter.drawLine(toQtLine(line))
             painter.setPen(pen.activePoint)
-            painter.drawPoint(line.p1.toQtPoint())
-            painter.drawPoint(line.p2.toQtPoint())
+            painter.drawPoint(toQtPoint(line.p1))
+            painter.drawPoint(toQtPoint(line.p2))
@@ -1,113 +1,1137 @@
+import heapq
+import time
 from abc import abstractmethod
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
 
 import numpy as np
-from PyQt5 import QtGui
-from scipy.optimize import fsolve
 
-from cad import pen
 from cad.figures import *
 
+# scipy and the process pool are imported where they are used, so the
+# geometry and the model load without them
 
-class System(object):
 
-    def __init__(self, sketch):
-        self.sketch = sketch
-        self.constraints = []
+class Jacobian(object):
+
+    def __init__(self, size: int):
+        self.size = size
+        self.rows = []
+        self.cols = []
+        self.values = []
+
+        self.blocks = []
+
+    def addBlock(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray):
+        rows, cols, values = np.broadcast_arrays(rows, cols, values)
+        self.blocks.append((rows.ravel(), cols.ravel(), values.ravel()))
+
+    def add(self, row: int, col: int, value: float):
+        self.rows.append(row)
+        self.cols.append(col)
+        self.values.append(value)
+
+    def addGradient(self, n: int, i: int, value: float):
+        # dg/dx_i is both the derivative of the constraint row n and the
+        # coefficient of the multiplier x[n] in the stationarity row i
+        self.add(n, i, value)
+        self.add(i, n, value)
+
+    def addHessian(self, i: int, j: int, value: float):
+        self.add(i, j, value)
+        if i != j:
+            self.add(j, i, value)
+
+    def toSparse(self) -> 'csr_matrix':
+        from scipy.sparse import coo_matrix
+
+        shape = (self.size, self.size)
+        rows = np.concatenate([self.rows] + [block[0] for block in self.blocks]).astype(int)
+        cols = np.concatenate([self.cols] + [block[1] for block in self.blocks]).astype(int)
+        values = np.concatenate([self.values] + [block[2] for block in self.blocks])
+        # duplicate entries are summed by the conversion
+        return coo_matrix((values, (rows, cols)), shape=shape).tocsr()
+
+
+class Batch(object):
+
+    def __init__(self, kind: type, constraints: list, rows: list):
+        self.kind = kind
+        self.rows = np.array(rows, dtype=int)
+
+        shape = (len(constraints), len(kind.coordinates))
+        cols = [c.slots[i] + j for c in constraints for i, j in kind.coordinates]
+        self.cols = np.array(cols, dtype=int).reshape(shape)
+
+        params = [c.parameters() for c in constraints]
+        self.params = np.array(params, dtype=float).reshape(len(constraints), -1)
+
+    def apply(self, x: np.ndarray, y: np.ndarray):
+        lagrange = x[self.rows]
+        g, grad = self.kind.evaluate(x[self.cols], self.params)
+
+        y[self.rows] = g
+        weights = (lagrange[:, None] * grad).ravel()
+        y += np.bincount(self.cols.ravel(), weights=weights, minlength=len(y))
+
+    def derivatives(self, x: np.ndarray, jacobian: Jacobian):
+        lagrange = x[self.rows]
+        g, grad = self.kind.evaluate(x[self.cols], self.params)
+
+        jacobian.addBlock(self.rows[:, None], self.cols, grad)
+        jacobian.addBlock(self.cols, self.rows[:, None], grad)
+
+        hessian = self.kind.hessian
+        if hessian is not None:
+            a, b = np.nonzero(hessian)
+            values = lagrange[:, None] * hessian[a, b]
+            jacobian.addBlock(self.cols[:, a], self.cols[:, b], values)
+
+
+# same layout as the full output of fsolve
+Solution = namedtuple('Solution', ('x', 'info', 'ier', 'message'))
+
+
+class SolveStats(namedtuple('SolveStats', (
+        'time', 'nfev', 'njev', 'residual', 'variables', 'constraints', 'clusters', 'converged'))):
 
     @property
-    def points(self) -> list:
-        points = []
-        for line in self.sketch.lines:
-            points.extend(line.points)
-        for point in self.sketch.points:
-            points.append(point)
-        return points
-
-    def addConstraint(self, constraint):
-        self.constraints.append(constraint)
+    def summary(self) -> str:
+        status = 'Solved' if self.converged else 'Not converged'
+        return '{}: {} variables, {} constraints in {} clusters, {:.1f} ms, {} evaluations, residual {:.2e}'.format(
+            status, self.variables, self.constraints, self.clusters, self.time * 1000, self.nfev, self.residual,
+        )
+
+
+class Backend(object):
+
+    # largest constraint violation a solution may leave to count as converged,
+    # as a distance relative to the size of the geometry of its cluster
+    tolerance = 1e-6
+
+    @abstractmethod
+    def solve(self, cluster) -> Solution:
+        pass
+
+
+class FsolveBackend(Backend):
+
+    def __init__(self, xtol: float = 1e-10, maxfev: int = 0, tolerance: float = 1e-6):
+        self.xtol = xtol
+        self.maxfev = maxfev
+        self.tolerance = tolerance
+
+    def solve(self, cluster) -> Solution:
+        from scipy.optimize import fsolve
+
+        x, info, ier, message = fsolve(
+            cluster.system, cluster.x0, fprime=cluster.fprime, full_output=True,
+            xtol=self.xtol, maxfev=self.maxfev,
+        )
+        return Solution(x, info, ier, message)
+
+
+class LeastSquaresBackend(Backend):
+
+    def __init__(self, ftol: float = 1e-8, xtol: float = 1e-8, maxfev: int = None, method: str = 'trf',
+                 tolerance: float = 1e-6):
+        self.ftol = ftol
+        self.xtol = xtol
+        self.maxfev = maxfev
+        self.method = method
+        self.tolerance = tolerance
+
+    def solve(self, cluster) -> Solution:
+        from scipy.optimize import least_squares
+
+        # the sparse trust region treats over- and under-constrained clusters
+        # as a least squares problem instead of failing on a singular jacobian
+        result = least_squares(
+            cluster.system, cluster.x0, jac=cluster.jacobian, method=self.method,
+            ftol=self.ftol, xtol=self.xtol, max_nfev=self.maxfev, tr_solver='lsmr',
+        )
+        info = {'nfev': result.nfev, 'njev': result.njev, 'fvec': result.fun}
+        return Solution(result.x, info, 1 if result.success else 0, result.message)
+
+
+class NewtonBackend(Backend):
+
+    def __init__(self, tol: float = 1e-6, maxiter: int = 100):
+        self.tol = tol
+        self.maxiter = maxiter
+
+    @property
+    def tolerance(self) -> float:
+        return self.tol
+
+    def solve(self, cluster) -> Solution:
+        # damped gauss-newton projection onto the constraints: every step is
+        # the smallest coordinate change that zeroes the linearized residuals.
+        # newton on the full lagrange system diverges once its hessian turns
+        # indefinite, e.g. on long pinned chains
+        from scipy.sparse import diags, identity
+        from scipy.sparse.linalg import splu
+
+        size = cluster.variables
+        # a merged unknown moves every coordinate it stands for
+        inverse = 1 / cluster.weights
+        tol = self.tol * cluster.scale
+        x = cluster.x0
+        y = cluster.system(x)
+        nfev, njev = 1, 0
+        damping = 1e-3
+
+        for _ in range(self.maxiter):
+            gradients = cluster.jacobian(x)[size:, :size]
+            njev += 1
+            # every row divided by the norm of its gradient is a distance, a
+            # length in units squared and an angle in units weigh the same
+            norms = np.sqrt(np.asarray(gradients.multiply(gradients).sum(axis=1)).ravel())
+            norms[norms == 0.] = 1.
+            residuals = y[size:] / norms
+            if not np.abs(residuals).max(initial=0.) > tol:
+                break
+
+            gradients = diags(1 / norms) @ gradients
+            normal = (gradients @ (gradients.T.multiply(inverse[:, None]))).tocsc()
+
+            # levenberg-marquardt: raise the damping until the violation drops
+            norm = np.linalg.norm(residuals)
+            while damping < 1e6:
+                regularized = normal + damping * identity(normal.shape[0], format='csc')
+                candidate = x.copy()
+                candidate[:size] -= inverse * (gradients.T @ splu(regularized).solve(residuals))
+                z = cluster.system(candidate)
+                nfev += 1
+                if np.linalg.norm(z[size:] / norms) < norm:
+                    damping = max(damping / 10, 1e-12)
+                    break
+                damping *= 10
+            else:
+                # no step reduces the violation: conflicting constraints
+                break
+
+            x, y = candidate, z
+
+        converged = np.abs(cluster.residuals(x)).max(initial=0.) <= tol
+        info = {'nfev': nfev, 'njev': njev, 'fvec': y[size:]}
+        message = 'converged' if converged else 'iteration limit reached'
+        return Solution(x, info, 1 if converged else 0, message)
+
+
+class ConstraintError(ValueError):
+
+    def __init__(self, constraint, message: str):
+        super().__init__(message)
+        self.constraint = constraint
 
-    def recount(self):
-        if len(self.x0):
-            result = self.solve()
-            if result[2] == 1:
-                y = [round(y, 1) for y in result[0]]
-                for i, point in enumerate(self.points):
-                    for j, prop in enumerate(('x', 'y')):
-                        n = i * 2 + j
-                        setattr(point, prop, y[n])
-
-    def solve(self):
-        result = fsolve(self.system, self.x0, full_output=True, xtol=1e-2)
-        return result
+
+class RedundantConstraintError(ConstraintError):
+    pass
+
+
+class ConflictingConstraintError(ConstraintError):
+    pass
+
+
+class ConstraintBasis(object):
+
+    INDEPENDENT, REDUNDANT, CONFLICTING, UNKNOWN = range(4)
+
+    def __init__(self, tolerance: float = 1e-6, distance: float = 1e-2):
+        self.tolerance = tolerance
+        self.distance = distance
+
+        # sparse echelon form of the constraint gradients keyed by (point, axis):
+        # each row holds the matching combination of the constraint residuals
+        # and none of the pivots of the rows added before it
+        self.rows = []
+        self.pivots = {}
+        # pivoting on the geometry seen first keeps chains of constraints banded
+        self.order = {}
+        # where each point was when a row first took it in. later constraints
+        # are linearized there too, so the rows stay one consistent
+        # linearization however the geometry moves since
+        self.positions = {}
+        # coordinates welded away: their rows tie two points together, the
+        # sketch has a single vertex there
+        self.identified = 0
+
+    @property
+    def rank(self) -> int:
+        return len(self.rows) - self.identified
+
+    def classify(self, constraint) -> tuple:
+        gradient, residual = constraint.linearize(self.positions)
+        norm = np.sqrt(sum(value ** 2 for value in gradient.values()))
+        if norm == 0.:
+            # a singular linearization, e.g. a length on a zero-length line,
+            # says nothing about the constraint
+            return self.UNKNOWN, None
+
+        row = {key: value / norm for key, value in gradient.items()}
+        residual = residual / norm
+
+        # eliminating the earliest row first only brings in pivots of later ones,
+        # so the rows touched stay local to the geometry the constraint acts on
+        pending = [self.pivots[key] for key in row if key in self.pivots]
+        heapq.heapify(pending)
+        eliminated = set()
+        while pending:
+            i = heapq.heappop(pending)
+            if i in eliminated:
+                continue
+            eliminated.add(i)
+
+            pivot, basis, rho = self.rows[i]
+            factor = row.pop(pivot, 0.) / basis[pivot]
+            for key, value in basis.items():
+                if key != pivot:
+                    row[key] = row.get(key, 0.) - factor * value
+                    j = self.pivots.get(key)
+                    if j is not None and j not in eliminated:
+                        heapq.heappush(pending, j)
+            residual -= factor * rho
+
+        row = {key: value for key, value in row.items() if abs(value) > self.tolerance}
+        if row:
+            largest = max(abs(value) for value in row.values())
+            candidates = [key for key, value in row.items() if abs(value) >= largest * .1]
+            pivot = min(candidates, key=lambda key: (self.order.get(key[0], len(self.order)), key[1]))
+            return self.INDEPENDENT, (pivot, row, residual)
+
+        # the gradient is a combination of the existing ones: the constraint is
+        # implied if its linearized residual is the same combination of theirs
+        status = self.REDUNDANT if abs(residual) <= self.distance else self.CONFLICTING
+        return status, None
+
+    def add(self, constraint, row: tuple):
+        for point in constraint.points:
+            self.positions.setdefault(point, point.coordinates)
+        self.pivots[row[0]] = len(self.rows)
+        self.rows.append(row)
+        for point, axis in row[1]:
+            self.order.setdefault(point, len(self.order))
+
+    def moved(self) -> bool:
+        # whether the geometry left the positions the rows were linearized at,
+        # a dependence found there may not hold where the points are now
+        return any(point.coordinates != position for point, position in self.positions.items())
+
+    def truncate(self, rank: int):
+        # drops the rows added since the basis had this rank
+        while self.rank > rank:
+            del self.pivots[self.rows.pop()[0]]
+
+
+class SolutionCache(object):
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        solution = self.entries.get(key)
+        if solution is not None:
+            self.entries.move_to_end(key)
+        return solution
+
+    def put(self, key, solution: np.ndarray):
+        self.entries[key] = solution
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class Cluster(object):
+
+    def __init__(self, points: list, constraints: list, batched: bool = True, presolve: bool = True):
+        self.points = points
+        self.constraints = constraints
+        self.batched = batched
+
+        self.index = {point: i * 2 for i, point in enumerate(points)}
+        for constraint in constraints:
+            constraint.bind(self.index)
+
+        # rows of the points in the coordinate buffer they all view, if any
+        stores = {point.store for point in points}
+        self.store = stores.pop() if len(stores) == 1 else None
+        self.rows = np.array([point.slot for point in points], dtype=int)
+
+        self.signature = (len(points), ) + tuple(
+            (type(c).__name__, c.slots, c.parameters()) for c in constraints
+        )
+
+        self.substitute(presolve)
+
+        self._batches = None
+        self._checks = None
+        self._coordinates = None
+        self._multipliers = None
+
+    def __getstate__(self) -> dict:
+        # worker processes get the snapshot, not the buffer of the whole drawing
+        state = dict(self.__dict__)
+        state['store'] = None
+        return state
+
+    def substitute(self, presolve: bool):
+        from scipy.sparse import coo_matrix
+
+        # constructive pre-solve: pinned and equated coordinates are merged into
+        # one unknown, only the remaining constraints get a multiplier
+        size = len(self.points) * 2
+        parent = list(range(size))
+        pinned = {}
+        self.numeric = []
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for constraint in self.constraints:
+            substitution = constraint.substitution() if presolve else None
+            if substitution is None:
+                self.numeric.append(constraint)
+                continue
+
+            columns, value = substitution
+            roots = [find(i) for i in columns]
+            values = {pinned[root] for root in roots if root in pinned}
+            if value is not None:
+                values.add(value)
+            if len(values) > 1:
+                # contradicting pins are left to the solver to report
+                self.numeric.append(constraint)
+                continue
+
+            for root in roots[1:]:
+                parent[root] = roots[0]
+            if values:
+                pinned[roots[0]] = values.pop()
+
+        roots = np.array([find(i) for i in range(size)], dtype=int)
+        free = np.array([root not in pinned for root in roots], dtype=bool)
+        _, reduction = np.unique(roots[free], return_inverse=True)
+
+        # coordinate -> reduced unknown, -1 for the pinned ones
+        self.reduction = np.full(size, -1, dtype=int)
+        self.reduction[free] = reduction
+        self.pinned = np.array([pinned.get(root, 0.) for root in roots], dtype=float)
+        # number of coordinates each unknown stands for
+        self.weights = np.bincount(reduction, minlength=0).astype(float)
+
+        # maps the reduced unknowns and multipliers onto the full layout
+        variables = len(self.weights)
+        rows = np.concatenate([np.flatnonzero(free), size + np.arange(len(self.numeric))])
+        cols = np.concatenate([reduction, variables + np.arange(len(self.numeric))])
+        shape = (size + len(self.numeric), variables + len(self.numeric))
+        self.projection = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=shape).tocsr()
+        self.offset = np.concatenate([self.pinned, np.zeros(len(self.numeric))])
+        if variables == size:
+            # nothing was substituted
+            self.projection = None
+
+    @property
+    def variables(self) -> int:
+        return len(self.weights)
+
+    @property
+    def size(self) -> int:
+        return self.variables + len(self.numeric)
+
+    @property
+    def batches(self) -> list:
+        if self._batches is None:
+            offset = len(self.points) * 2
+            groups = {}
+            for i, constraint in enumerate(self.numeric):
+                group = groups.setdefault(type(constraint), ([], []))
+                group[0].append(constraint)
+                group[1].append(offset + i)
+
+            self._batches = [Batch(kind, *group) for kind, group in groups.items()]
+        return self._batches
+
+    @property
+    def checks(self) -> list:
+        # every constraint, the substituted ones too, grouped by type
+        if self._checks is None:
+            groups = {}
+            for constraint in self.constraints:
+                groups.setdefault(type(constraint), []).append(constraint)
+            self._checks = [Batch(kind, constraints, []) for kind, constraints in groups.items()]
+        return self._checks
+
+    def residuals(self, x: np.ndarray) -> np.ndarray:
+        # violation of every constraint at the coordinates of a solution, the
+        # same measure whichever backend found it. each residual is divided by
+        # the norm of its gradient, a distance whatever the constraint
+        coordinates = self.expand(x)[:len(self.points) * 2]
+        residuals = []
+        for batch in self.checks:
+            g, grad = batch.kind.evaluate(coordinates[batch.cols], batch.params)
+            norms = np.sqrt((grad ** 2).sum(axis=1))
+            residuals.append(g / np.where(norms == 0., 1., norms))
+        return np.concatenate(residuals) if residuals else np.zeros(0)
+
+    @property
+    def scale(self) -> float:
+        # size of the geometry, tolerances are relative to it
+        coordinates = self.coordinates.reshape(-1, 2)
+        if not len(coordinates):
+            return 1.
+        return max(float(np.ptp(coordinates, axis=0).max()), 1.)
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        if self._coordinates is None:
+            if self.store is not None:
+                self._coordinates = self.store.coordinates[self.rows].reshape(-1)
+            else:
+                coordinates = [point.coordinates for point in self.points]
+                self._coordinates = np.array(coordinates, dtype=float).reshape(-1)
+        return self._coordinates
+
+    def write(self, coordinates: np.ndarray):
+        if self.store is not None:
+            self.store.coordinates[self.rows] = coordinates.reshape(-1, 2)
+            self.store.moved.update(self.rows.tolist())
+            self.store.changed()
+            return
+        for point, (x, y) in zip(self.points, coordinates.reshape(-1, 2).tolist()):
+            point.x = x
+            point.y = y
+
+    @property
+    def multipliers(self) -> np.ndarray:
+        if self._multipliers is None:
+            multipliers = [constraint.multiplier for constraint in self.numeric]
+            self._multipliers = np.array(multipliers, dtype=float)
+        return self._multipliers
+
+    def snapshot(self):
+        self._coordinates = None
+        self._multipliers = None
+        self.coordinates
+        self.multipliers
+        self.batches
+        self.checks
+
+    def key(self) -> tuple:
+        self.snapshot()
+        return self.signature, self.coordinates.tobytes()
+
+    def solve(self, backend: Backend) -> Solution:
+        # solves the last snapshot of the geometry
+        if not self.numeric:
+            # nothing left after the substitution: the closest solution is known
+            info = {'nfev': 0, 'fvec': np.zeros(0)}
+            return Solution(self.x0, info, 1, 'solved by substitution')
+        return backend.solve(self)
+
+    def expand(self, x: np.ndarray) -> np.ndarray:
+        # full coordinates and multipliers of the numeric constraints
+        if self.projection is None:
+            return x
+        return self.projection @ x + self.offset
+
+    def contract(self, y: np.ndarray) -> np.ndarray:
+        # sums the rows of merged coordinates, drops those of pinned ones
+        if self.projection is None:
+            return y
+        return self.projection.T @ y
+
+    def contractJacobian(self, jacobian: 'csr_matrix') -> 'csr_matrix':
+        if self.projection is None:
+            return jacobian
+        return (self.projection.T @ jacobian @ self.projection).tocsr()
 
     def system(self, x: np.ndarray) -> np.ndarray:
+        x = self.expand(x)
         y = np.zeros(shape=x.shape, dtype=x.dtype)
 
+        if self.batched:
+            size = len(self.points) * 2
+            y[:size] = 2 * (x[:size] - self.coordinates)
+            for batch in self.batches:
+                batch.apply(x, y)
+            return self.contract(y)
+
         for i, point in enumerate(self.points):
             for j, coordinate in enumerate(point.coordinates):
                 n = i * 2 + j
                 y[n] = 2 * (x[n] - coordinate)
 
-        for i, constraint in enumerate(self.constraints):
+        for i, constraint in enumerate(self.numeric):
             n = len(self.points) * 2 + i
             constraint.apply(self, x, y, n)
 
-        return y
+        return self.contract(y)
+
+    def jacobian(self, x: np.ndarray) -> 'csr_matrix':
+        x = self.expand(x)
+        jacobian = Jacobian(len(x))
+
+        if self.batched:
+            diagonal = np.arange(len(self.points) * 2)
+            jacobian.addBlock(diagonal, diagonal, 2.)
+            for batch in self.batches:
+                batch.derivatives(x, jacobian)
+            return self.contractJacobian(jacobian.toSparse())
+
+        for n in range(len(self.points) * 2):
+            jacobian.add(n, n, 2.)
+
+        for i, constraint in enumerate(self.numeric):
+            n = len(self.points) * 2 + i
+            constraint.derivatives(self, x, jacobian, n)
+
+        return self.contractJacobian(jacobian.toSparse())
+
+    def fprime(self, x: np.ndarray) -> np.ndarray:
+        # MINPACK only accepts a dense jacobian
+        return self.jacobian(x).toarray()
 
     @property
     def x0(self) -> np.ndarray:
-        size = len(self.points) * 2 + len(self.constraints)
-        y = np.zeros(shape=(size, ), dtype=float)
-        return y
+        # warm start from the current geometry and the last converged multipliers,
+        # merged coordinates start from the mean of their points
+        free = self.reduction >= 0
+        sums = np.bincount(self.reduction[free], weights=self.coordinates[free], minlength=self.variables)
+        return np.concatenate([sums / np.maximum(self.weights, 1.), self.multipliers])
 
 
-class Handler:
+def solveCluster(cluster: Cluster, backend: Backend) -> Solution:
+    return cluster.solve(backend)
 
-    def mouseMoved(self, sketch):
-        pass
 
-    def mousePressed(self, sketch):
-        pass
+class Job(object):
 
-    def mouseReleased(self, sketch):
-        pass
+    def __init__(self, revision: int, clusters: list, backend: Backend, cached: bool):
+        self.revision = revision
+        self.clusters = clusters
+        self.backend = backend
+        self.cached = cached
 
+        # snapshot the inputs so the job can be solved on another thread
+        self.keys = [cluster.key() for cluster in clusters]
+        self.results = [None] * len(clusters)
+        self.stats = None
 
-class DisableHandler(Handler):
-    pass
+        # the state System.prepare cleared for it
+        self.stale = False
+        self.touched = set()
 
 
-class LineDrawing(Handler):
+class System(object):
 
-    def mousePressed(self, sketch):
-        p1 = sketch.getPressedPosition()
-        p2 = sketch.getCurrentPosition()
+    # clusters with at least this many unknowns go to the process pool
+    parallelSize = 200
 
-        sketch.addLine(Line(p1, p2))
-        sketch.update()
+    def __init__(self, sketch, batched: bool = True, workers: int = 0, cacheSize: int = 64, backend: Backend = None,
+                 historySize: int = 100, presolve: bool = True):
+        self.sketch = sketch
+        self.constraints = []
+        self.history = deque(maxlen=historySize)
+        self.batched = batched
+        self.presolve = presolve
+        self.workers = workers
+        self.cache = SolutionCache(cacheSize)
+        self._backend = backend or NewtonBackend()
+
+        # relaxed, bounded engine used while the user drags geometry, within a
+        # tenth of a unit on a drawing a thousand units across
+        self.dragBackend = NewtonBackend(tol=1e-4, maxiter=5)
+        self.dragging = False
+        self._dragged = set()
+
+        self._points = None
+        self._index = None
+        self._clusters = None
+        self._owners = None
+        self._incident = None
+        self._pool = None
+
+        # model revision, bumped on every change that can move the solution
+        self.revision = 0
+        self.solvedRevision = 0
+        self._stale = False
+        self._touched = set()
+
+        # linearization of the constraints, kept until geometry is erased, and
+        # the constraints it could not linearize yet
+        self._basis = None
+        self._unknown = []
+
+        # constraints added inside a transaction, checked when it ends
+        self._transactions = 0
+        self._pending = []
 
-    def mouseMoved(self, sketch):
-        if sketch.isMousePressed():
-            sketch.lines[-1].p2 = sketch.getCurrentPosition()
+    @property
+    def points(self) -> list:
+        if self._points is None:
+            points = []
+            for line in self.sketch.lines:
+                points.extend(line.points)
+            for point in self.sketch.points:
+                points.append(point)
+            # welded lines share their vertex
+            self._points = list(dict.fromkeys(points))
+        return self._points
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            index = {point: i * 2 for i, point in enumerate(self.points)}
 
+            # constraints of erased geometry have nothing left to act on
+            constraints = [c for c in self.constraints if all(p in index for p in c.points)]
+            if len(constraints) != len(self.constraints):
+                self.constraints = constraints
+                self._basis = None
+                self._incident = None
+
+            self._index = index
+        return self._index
+
+    @property
+    def clusters(self) -> list:
+        if self._clusters is None:
+            index = self.index
+            parents = list(range(len(self.points)))
+
+            def find(i: int) -> int:
+                while parents[i] != i:
+                    parents[i] = parents[parents[i]]
+                    i = parents[i]
+                return i
+
+            for constraint in self.constraints:
+                roots = [find(index[point] // 2) for point in constraint.points]
+                for root in roots[1:]:
+                    parents[root] = roots[0]
+
+            # points outside every constraint are already at their solution
+            groups = {}
+            for constraint in self.constraints:
+                root = find(index[constraint.points[0]] // 2)
+                groups.setdefault(root, ([], []))[1].append(constraint)
+            for i, point in enumerate(self.points):
+                group = groups.get(find(i))
+                if group is not None:
+                    group[0].append(point)
+
+            self._clusters = [
+                Cluster(points, constraints, self.batched, self.presolve) for points, constraints in groups.values()
+            ]
+            self._owners = {point: cluster for cluster in self._clusters for point in cluster.points}
+        return self._clusters
+
+    def connected(self, points) -> set:
+        # the points a solve can move along with these, those of their clusters
+        self.clusters
+        found = set(points)
+        for cluster in {self._owners[point] for point in found if point in self._owners}:
+            found.update(cluster.points)
+        return found
 
-class PointDrawing(Handler):
+    @property
+    def incident(self) -> dict:
+        # point -> constraints acting on it, directly or through a line
+        if self._incident is None:
+            incident = {}
+            for constraint in self.constraints:
+                for point in constraint.points:
+                    incident.setdefault(point, set()).add(constraint)
+            self._incident = incident
+        return self._incident
+
+    @property
+    def pool(self) -> 'ProcessPoolExecutor':
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    @property
+    def dirty(self) -> bool:
+        return self.revision != self.solvedRevision
 
-    def mousePressed(self, sketch):
-        point = sketch.getPressedPosition()
-        sketch.addPoint(point)
-        sketch.update()
+    def touch(self, *points):
+        self.revision += 1
+        self._touched.update(points)
+        if self.dragging:
+            self._dragged.update(points)
+
+    def beginDrag(self):
+        self.dragging = True
+
+    def endDrag(self):
+        self.dragging = False
+        # one full accuracy solve of every cluster moved by the drag
+        self.touch(*self._dragged)
+        self._dragged.clear()
+
+    @property
+    def backend(self) -> Backend:
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend: Backend):
+        # cached solutions depend on the engine and its tolerances
+        self._backend = backend
+        self.cache.clear()
+
+    def invalidate(self, erased: bool = False):
+        self._points = None
+        self._index = None
+        self._clusters = None
+        self._owners = None
+
+        if erased:
+            # the constraints of erased geometry are dropped with the next index
+            self._basis = None
+            self._incident = None
+
+        self.revision += 1
+        self._stale = True
+
+    @property
+    def basis(self) -> ConstraintBasis:
+        if self._basis is None:
+            self.index  # drops the constraints of erased geometry
+            basis = ConstraintBasis()
+            self._unknown = []
+            for constraint in self.constraints:
+                status, vector = basis.classify(constraint)
+                if status == basis.INDEPENDENT:
+                    basis.add(constraint, vector)
+                elif status == basis.UNKNOWN:
+                    self._unknown.append(constraint)
+            self._basis = basis
+        return self._basis
+
+    def classify(self, constraint) -> tuple:
+        # a constraint the basis finds dependent on rows linearized before the
+        # geometry moved is judged again on rows linearized where it is now.
+        # only the first such check after a move rebuilds the basis
+        status, vector = self.basis.classify(constraint)
+        if status in (ConstraintBasis.REDUNDANT, ConstraintBasis.CONFLICTING) and self.basis.moved():
+            self._basis = None
+            status, vector = self.basis.classify(constraint)
+        return status, vector
+
+    def settle(self):
+        # the geometry may have left the degenerate spot that kept a constraint
+        # out of the basis, those are tried again
+        basis = self.basis
+        unknown, self._unknown = self._unknown, []
+        for constraint in unknown:
+            status, vector = basis.classify(constraint)
+            if status == basis.INDEPENDENT:
+                basis.add(constraint, vector)
+            elif status == basis.UNKNOWN:
+                self._unknown.append(constraint)
+
+    @property
+    def rank(self) -> int:
+        self.settle()
+        return self.basis.rank
+
+    @property
+    def dof(self) -> int:
+        self.index  # drops the constraints of erased geometry
+        return len(self.points) * 2 - self.rank
+
+    def identify(self, p1: Point, p2: Point):
+        # a weld is a rank update: the basis takes the points as coincident and
+        # keeps both, the two coordinates the weld removes come off its rank.
+        # raises like addConstraint would when the weld conflicts
+        basis = self.basis
+        rank = basis.rank
+        try:
+            for constraint in (CoincidentX(p1, p2), CoincidentY(p1, p2)):
+                status, vector = basis.classify(constraint)
+                if status == ConstraintBasis.CONFLICTING and basis.moved():
+                    # judged again on rows linearized at the current geometry
+                    self._basis = None
+                    return self.identify(p1, p2)
+                if status == ConstraintBasis.CONFLICTING:
+                    raise ConflictingConstraintError(constraint, 'The constraint conflicts with the sketch')
+                if status == ConstraintBasis.INDEPENDENT:
+                    basis.add(constraint, vector)
+        except ConstraintError:
+            basis.truncate(rank)
+            raise
+        basis.identified += 2
+
+    def replace(self, merged: Point, root: Point) -> list:
+        # the constraints on a welded point move onto the vertex it joined,
+        # returns the ones that held it directly with the attributes changed
+        constraints = self.incident.pop(merged, set())
+        self.incident.setdefault(root, set()).update(constraints)
+        replaced = [(constraint, constraint.replace(merged, root)) for constraint in constraints]
+        return [(constraint, names) for constraint, names in replaced if names]
+
+    @contextmanager
+    def transaction(self):
+        # defers the constraint checks, index rebuilds and recounts of a batch of
+        # edits to the end of the outermost transaction. nothing is rolled back
+        self._transactions += 1
+        try:
+            yield self
+        finally:
+            self._transactions -= 1
+            if not self._transactions:
+                self.commit()
+
+    def commit(self):
+        pending, self._pending = self._pending, []
+
+        # every accepted constraint is kept, the first rejected one is raised
+        rejected = None
+        for constraint, check in pending:
+            try:
+                self.addConstraint(constraint, check)
+            except ConstraintError as e:
+                rejected = rejected or e
+        if rejected is not None:
+            raise rejected
+
+    def addConstraint(self, constraint, check: bool = True):
+        if self._transactions:
+            self._pending.append((constraint, check))
+            return
+
+        # cheap linearized rank test, before any solve
+        status, vector = self.classify(constraint)
+        if check and status == ConstraintBasis.REDUNDANT:
+            raise RedundantConstraintError(constraint, 'The constraint is already implied by the sketch')
+        if check and status == ConstraintBasis.CONFLICTING:
+            raise ConflictingConstraintError(constraint, 'The constraint conflicts with the sketch')
+        if status == ConstraintBasis.INDEPENDENT:
+            self.basis.add(constraint, vector)
+        elif status == ConstraintBasis.UNKNOWN:
+            self._unknown.append(constraint)
+
+        self.constraints.append(constraint)
+        if self._incident is not None:
+            for point in constraint.points:
+                self._incident.setdefault(point, set()).add(constraint)
+        self._clusters = None
+        self._owners = None
+
+        self.revision += 1
+        self._stale = True
+
+    def prepare(self):
+        if not self.dirty or self._transactions:
+            return None
+
+        clusters = self.clusters
+        if not self._stale:
+            # only the clusters holding moved points can have a new solution
+            owners = self._owners
+            touched = {owners[point] for point in self._touched if point in owners}
+            clusters = [cluster for cluster in clusters if cluster in touched]
+
+        backend = self.dragBackend if self.dragging else None
+        job = self.snapshot(clusters, backend)
+        # what the job took over, handed back if it is never applied
+        job.stale, job.touched = self._stale, self._touched
+
+        self.solvedRevision = self.revision
+        self._stale = False
+        self._touched = set()
+        return job
+
+    def retry(self, job: Job):
+        # a job dropped before it ran or rejected as outdated: its clusters
+        # still need a solve, the next prepare takes them again
+        self._stale = self._stale or job.stale
+        self._touched.update(job.touched)
+        self.solvedRevision = None
+
+    def snapshot(self, clusters: list, backend: Backend = None) -> Job:
+        # only solutions of the configured backend are cached
+        cached = backend is None
+        job = Job(self.revision, clusters, backend or self.backend, cached)
+
+        if cached:
+            for i, key in enumerate(job.keys):
+                solution = self.cache.get(key)
+                if solution is not None:
+                    job.results[i] = Solution(solution, {'nfev': 0}, 1, 'cached')
+        return job
+
+    @property
+    def stats(self) -> SolveStats:
+        return self.history[-1] if self.history else None
+
+    def compute(self, job: Job) -> list:
+        # safe to run off the GUI thread, it only touches the job snapshot
+        start = time.perf_counter()
+        results = list(job.results)
+
+        futures = {}
+        if self.workers:
+            for i, cluster in enumerate(job.clusters):
+                if results[i] is None and cluster.size >= self.parallelSize:
+                    futures[i] = self.pool.submit(solveCluster, cluster, job.backend)
+
+        for i, cluster in enumerate(job.clusters):
+            if results[i] is None and i not in futures:
+                results[i] = cluster.solve(job.backend)
+
+        for i, future in futures.items():
+            results[i] = future.result()
+
+        # the backends report their own measures of progress, every solution
+        # is judged by what is left of the constraints at its coordinates
+        residuals = []
+        for i, cluster in enumerate(job.clusters):
+            residual = cluster.residuals(results[i].x)
+            converged = not np.abs(residual).max(initial=0.) > job.backend.tolerance * cluster.scale
+            results[i] = results[i]._replace(ier=1 if converged else 0)
+            residuals.append(residual)
+
+        job.stats = SolveStats(
+            time=time.perf_counter() - start,
+            nfev=sum(result.info.get('nfev', 0) for result in results),
+            njev=sum(result.info.get('njev', 0) for result in results),
+            residual=float(np.linalg.norm(np.concatenate(residuals))) if residuals else 0.,
+            variables=sum(cluster.variables for cluster in job.clusters),
+            constraints=sum(len(cluster.constraints) for cluster in job.clusters),
+            clusters=len(job.clusters),
+            converged=all(result.ier == 1 for result in results),
+        )
+        return results
+
+    def apply(self, job: Job, results: list) -> bool:
+        if job.stats is not None:
+            self.history.append(job.stats)
+
+        if job.revision != self.revision:
+            self.retry(job)
+            return False
+
+        for cluster, key, result in zip(job.clusters, job.keys, results):
+            if result.ier == 1:
+                size = len(cluster.points) * 2
+                x = cluster.expand(result.x)
+                cluster.write(np.round(x[:size], 1))
+                for constraint, multiplier in zip(cluster.numeric, x[size:]):
+                    constraint.multiplier = multiplier
+
+                if job.cached:
+                    self.cache.put(key, result.x)
+                    # a converged state solves to itself
+                    self.cache.put(cluster.key(), result.x)
+        return True
+
+    def recount(self):
+        job = self.prepare()
+        if job is not None:
+            self.apply(job, self.compute(job))
+
+    def solve(self, clusters: list = None, backend: Backend = None) -> list:
+        if clusters is None:
+            clusters = self.clusters
+        return self.compute(self.snapshot(clusters, backend))
+
+
+def difference(c: np.ndarray, params: np.ndarray) -> tuple:
+    g = c[:, 1] - c[:, 0]
+    grad = np.broadcast_to(np.array([-1., 1.]), c.shape)
+    return g, grad
+
+
+def equality(constraint) -> tuple:
+    # both coordinates of a difference become one unknown
+    return tuple(constraint.slots[i] + j for i, j in constraint.coordinates), None
 
 
 class Constraint(object):
 
+    slots = ()
+    # lagrange multiplier of the last converged solve
+    multiplier = 0.
+
+    # (point, axis) pairs gathered into the columns of a batched evaluation
+    coordinates = ()
+    # constant second derivatives of the residual, None for linear constraints
+    hessian = None
+
+    @property
     @abstractmethod
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
+    def points(self) -> tuple:
+        pass
+
+    def bind(self, index: dict):
+        self.slots = tuple(index[point] for point in self.points)
+
+    def parameters(self) -> tuple:
+        return ()
+
+    def replace(self, old: Point, new: Point) -> list:
+        # points held directly rather than through a line
+        names = [name for name, value in vars(self).items() if value is old]
+        for name in names:
+            setattr(self, name, new)
+        return names
+
+    # (slots, value) of coordinates the pre-solve can eliminate: all set to
+    # value, or made equal when it is None
+    def substitution(self) -> tuple:
+        return None
+
+    def linearize(self, positions: dict = None) -> tuple:
+        # gradient and residual at the current geometry, or where positions
+        # puts the points it holds
+        positions = positions or {}
+        points = self.points
+        coordinates = [positions.get(point) or point.coordinates for point in points]
+        c = np.array([[coordinates[i][j] for i, j in self.coordinates]], dtype=float)
+        params = np.array([self.parameters()], dtype=float).reshape(1, -1)
+        g, grad = self.evaluate(c, params)
+
+        gradient = {}
+        for (i, j), value in zip(self.coordinates, grad[0]):
+            key = points[i], j
+            gradient[key] = gradient.get(key, 0.) + value
+        return gradient, g[0]
+
+    @classmethod
+    @abstractmethod
+    def evaluate(cls, c: np.ndarray, params: np.ndarray) -> tuple:
+        pass
+
+    @abstractmethod
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        pass
+
+    @abstractmethod
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
         pass
 
 
 class Parallel(Constraint):
 
+    coordinates = ((0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1), (3, 0), (3, 1))
+    hessian = np.zeros((8, 8))
+    hessian[2, 7] = hessian[7, 2] = hessian[0, 5] = hessian[5, 0] = 1.
+    hessian[2, 5] = hessian[5, 2] = hessian[0, 7] = hessian[7, 0] = -1.
+    hessian[3, 4] = hessian[4, 3] = hessian[1, 6] = hessian[6, 1] = 1.
+    hessian[3, 6] = hessian[6, 3] = hessian[1, 4] = hessian[4, 1] = -1.
+
     def __init__(self, l1: Line, l2: Line):
         self.l1 = l1
         self.l2 = l2
@@ -128,11 +1152,12 @@ class Parallel(Constraint):
     def p4(self) -> Point:
         return self.l2.p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2
-        i2 = system.points.index(self.p2) * 2
-        i3 = system.points.index(self.p3) * 2
-        i4 = system.points.index(self.p4) * 2
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2, self.p3, self.p4
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2, i3, i4 = self.slots
 
         y[i1] -= (x[i4 + 1] - x[i3 + 1]) * x[n]
         y[i2] += (x[i4 + 1] - x[i3 + 1]) * x[n]
@@ -146,33 +1171,58 @@ class Parallel(Constraint):
 
         y[n] = (x[i2] - x[i1]) * (x[i4 + 1] - x[i3 + 1]) - (x[i2 + 1] - x[i1 + 1]) * (x[i4] - x[i3])
 
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2, i3, i4 = self.slots
+
+        jacobian.addGradient(n, i1, -(x[i4 + 1] - x[i3 + 1]))
+        jacobian.addGradient(n, i2, x[i4 + 1] - x[i3 + 1])
+        jacobian.addGradient(n, i3, x[i2 + 1] - x[i1 + 1])
+        jacobian.addGradient(n, i4, -(x[i2 + 1] - x[i1 + 1]))
 
-class ParallelHandler(Handler):
+        jacobian.addGradient(n, i1 + 1, x[i4] - x[i3])
+        jacobian.addGradient(n, i2 + 1, -(x[i4] - x[i3]))
+        jacobian.addGradient(n, i3 + 1, -(x[i2] - x[i1]))
+        jacobian.addGradient(n, i4 + 1, x[i2] - x[i1])
 
-    def __init__(self):
-        self.l1 = None
+        jacobian.addHessian(i2, i4 + 1, x[n])
+        jacobian.addHessian(i2, i3 + 1, -x[n])
+        jacobian.addHessian(i1, i4 + 1, -x[n])
+        jacobian.addHessian(i1, i3 + 1, x[n])
 
-    def mousePressed(self, sketch):
-        if not self.l1:
-            line = sketch.getActiveLine()
-            if line:
-                self.l1 = line
-        else:
-            l2 = sketch.getActiveLine()
-            if l2:
-                constraint = Parallel(self.l1, l2)
-                self.l1 = None
+        jacobian.addHessian(i2 + 1, i4, -x[n])
+        jacobian.addHessian(i2 + 1, i3, x[n])
+        jacobian.addHessian(i1 + 1, i4, x[n])
+        jacobian.addHessian(i1 + 1, i3, -x[n])
 
-                sketch.system.addConstraint(constraint)
-                sketch.update()
+    @classmethod
+    def evaluate(cls, c: np.ndarray, params: np.ndarray) -> tuple:
+        dx1 = c[:, 2] - c[:, 0]
+        dy1 = c[:, 3] - c[:, 1]
+        dx2 = c[:, 6] - c[:, 4]
+        dy2 = c[:, 7] - c[:, 5]
+
+        g = dx1 * dy2 - dy1 * dx2
+        grad = np.stack([-dy2, dx2, dy2, -dx2, dy1, -dx1, -dy1, dx1], axis=1)
+        return g, grad
 
 
 class Length(Constraint):
 
+    coordinates = ((0, 0), (0, 1), (1, 0), (1, 1))
+    hessian = 2 * np.array([
+        [1., 0., -1., 0.],
+        [0., 1., 0., -1.],
+        [-1., 0., 1., 0.],
+        [0., -1., 0., 1.],
+    ])
+
     def __init__(self, line: Line, length: float):
         self.line = line
         self.length = length
 
+    def parameters(self) -> tuple:
+        return self.length,
+
     @property
     def p1(self) -> Point:
         return self.line.p1
@@ -181,9 +1231,12 @@ class Length(Constraint):
     def p2(self) -> Point:
         return self.line.p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2
-        i2 = system.points.index(self.p2) * 2
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2 = self.slots
 
         dx = x[i2] - x[i1]
         dy = x[i2 + 1] - x[i1 + 1]
@@ -196,80 +1249,114 @@ class Length(Constraint):
 
         y[n] = dx ** 2 + dy ** 2 - self.length ** 2
 
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2 = self.slots
 
-class LengthHandler(Handler):
-
-    def __init__(self, length: float):
-        self.length = length
-
-    def mousePressed(self, sketch):
-        line = sketch.getActiveLine()
-        if line:
-            constraint = Length(line, self.length)
-            sketch.system.addConstraint(constraint)
-            sketch.update()
+        for j in (0, 1):
+            d = x[i2 + j] - x[i1 + j]
 
+            jacobian.addGradient(n, i2 + j, 2 * d)
+            jacobian.addGradient(n, i1 + j, -2 * d)
 
-class AngleHandler(Handler):
+            jacobian.addHessian(i1 + j, i1 + j, 2 * x[n])
+            jacobian.addHessian(i2 + j, i2 + j, 2 * x[n])
+            jacobian.addHessian(i1 + j, i2 + j, -2 * x[n])
 
-    def __init__(self, angle: float):
-        self.angle = angle
+    @classmethod
+    def evaluate(cls, c: np.ndarray, params: np.ndarray) -> tuple:
+        dx = c[:, 2] - c[:, 0]
+        dy = c[:, 3] - c[:, 1]
 
-    def mousePressed(self, sketch):
-        line = sketch.getActiveLine()
-        if line:
-            constraint = Angle(line, self.angle)
-            sketch.system.addConstraint(constraint)
-            sketch.update()
+        g = dx ** 2 + dy ** 2 - params[:, 0] ** 2
+        grad = 2 * np.stack([-dx, -dy, dx, dy], axis=1)
+        return g, grad
 
 
 class FixingX(Constraint):
 
+    coordinates = ((0, 0), )
+
     def __init__(self, point: Point, value: float):
         self.point = point
         self.value = value
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i = system.points.index(self.point) * 2
+    def parameters(self) -> tuple:
+        return self.value,
+
+    def substitution(self) -> tuple:
+        return (self.slots[0], ), self.value
+
+    @property
+    def points(self) -> tuple:
+        return self.point,
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i = self.slots[0]
 
         y[i] += x[n]
 
         y[n] = x[i] - self.value
 
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i = self.slots[0]
+
+        jacobian.addGradient(n, i, 1.)
+
+    @classmethod
+    def evaluate(cls, c: np.ndarray, params: np.ndarray) -> tuple:
+        g = c[:, 0] - params[:, 0]
+        grad = np.ones_like(c)
+        return g, grad
+
 
 class FixingY(Constraint):
 
+    coordinates = ((0, 1), )
+
     def __init__(self, point: Point, value: float):
         self.point = point
         self.value = value
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i = system.points.index(self.point) * 2 + 1
+    def parameters(self) -> tuple:
+        return self.value,
+
+    def substitution(self) -> tuple:
+        return (self.slots[0] + 1, ), self.value
+
+    @property
+    def points(self) -> tuple:
+        return self.point,
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i = self.slots[0] + 1
 
         y[i] += x[n]
 
         y[n] = x[i] - self.value
 
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i = self.slots[0] + 1
 
-class FixingHandler(Handler):
-
-    def __init__(self, x: float, y: float):
-        self.x = x
-        self.y = y
+        jacobian.addGradient(n, i, 1.)
 
-    def mousePressed(self, sketch):
-        point = sketch.getActivePoint()
-        if point:
-            sketch.system.addConstraint(FixingX(point, self.x))
-            sketch.system.addConstraint(FixingY(point, self.y))
+    @classmethod
+    def evaluate(cls, c: np.ndarray, params: np.ndarray) -> tuple:
+        g = c[:, 0] - params[:, 0]
+        grad = np.ones_like(c)
+        return g, grad
 
 
 class Angle(Constraint):
 
+    coordinates = ((0, 0), (0, 1), (1, 0), (1, 1))
+
     def __init__(self, line: Line, angle: float):
         self.line = line
         self.tan = np.tan(angle * np.pi / 180)
 
+    def parameters(self) -> tuple:
+        return self.tan,
+
     @property
     def p1(self) -> Point:
         return self.line.p1
@@ -278,96 +1365,44 @@ class Angle(Constraint):
     def p2(self) -> Point:
         return self.line.p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2
-        i2 = system.points.index(self.p2) * 2
-
-        y[i2] += x[n]
-        y[i1] -= x[n]
-
-        y[i2 + 1] += x[n] * self.tan
-        y[i1 + 1] -= x[n] * self.tan
-
-        y[n] = x[i2 + 1] - x[i1 + 1] - (x[i2] - x[i1]) * self.tan
-
-
-class VerticalHandler(Handler):
-
-    def mousePressed(self, sketch):
-        line = sketch.getActiveLine()
-        if line:
-            sketch.system.addConstraint(Vertical(line))
-            sketch.update()
-
-class VerticalLineHandler(Handler):
-
-    def __init__(self):
-        self.p1 = None
-
-    def mousePressed(self, sketch):
-        if not self.p1:
-            self.p1 = Point(sketch.getPressedPosition().x, 0)  # Set the first point to the top of the canvas
-
-    def mouseReleased(self, sketch):
-        if self.p1:
-            p2 = Point(self.p1.x, sketch.height())  # Set the second point to the bottom of the canvas
-            sketch.addLine(Line(self.p1, p2))
-            sketch.update()
-            self.p1 = None
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2
 
-class HorizontalHandler(Handler):
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2 = self.slots
 
-    def mousePressed(self, sketch):
-        line = sketch.getActiveLine()
-        if line:
-            constraint = Horizontal(line)
-            sketch.system.addConstraint(constraint)
-            sketch.update()
+        y[i2] -= x[n] * self.tan
+        y[i1] += x[n] * self.tan
 
-class HorizontalLineHandler(Handler):
+        y[i2 + 1] += x[n]
+        y[i1 + 1] -= x[n]
 
-    def __init__(self):
-        self.p1 = None
+        y[n] = x[i2 + 1] - x[i1 + 1] - (x[i2] - x[i1]) * self.tan
 
-    def mousePressed(self, sketch):
-        if not self.p1:
-            self.p1 = Point(0, sketch.getPressedPosition().y)  # Set the first point to the left edge of the canvas
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2 = self.slots
 
-    def mouseReleased(self, sketch):
-        if self.p1:
-            p2 = Point(sketch.width(), self.p1.y)  # Set the second point to the right edge of the canvas
-            sketch.addLine(Line(self.p1, p2))
-            sketch.update()
-            self.p1 = None
+        jacobian.addGradient(n, i2, -self.tan)
+        jacobian.addGradient(n, i1, self.tan)
 
-class CircleDrawingHandler(Handler):
-    def __init__(self):
-        self.center = None
-        self.radius = None
+        jacobian.addGradient(n, i2 + 1, 1.)
+        jacobian.addGradient(n, i1 + 1, -1.)
 
-    def mousePressed(self, sketch):
-        if not self.center:
-            self.center = sketch.getPressedPosition()
+    @classmethod
+    def evaluate(cls, c: np.ndarray, params: np.ndarray) -> tuple:
+        tan = params[:, 0]
 
-    def mouseReleased(self, sketch):
-        if self.center:
-            radius = self.center.distToPoint(sketch.currentPos)
-            sketch.addCircle(Circle(self.center, radius))
-            sketch.update()
-            self.center = None
+        g = c[:, 3] - c[:, 1] - (c[:, 2] - c[:, 0]) * tan
+        grad = np.stack([tan, -np.ones_like(tan), -tan, np.ones_like(tan)], axis=1)
+        return g, grad
 
-    def mouseMoved(self, sketch):
-        if self.center:
-            self.radius = self.center.distToPoint(sketch.currentPos)
-            sketch.update()
 
-    def draw(self, painter):
-        if self.center:
-            painter.setPen(pen.line)
-            painter.setBrush(QtGui.QBrush(QtGui.QColor(0, 0, 0, 0)))  # Transparent fill
-            painter.drawEllipse(self.center.toQtPoint(), int(self.radius), int(self.radius))
+class Vertical(Constraint):
 
-class Vertical(Constraint, Handler):
+    coordinates = ((0, 0), (1, 0))
+    evaluate = staticmethod(difference)
+    substitution = equality
 
     def __init__(self, line: Line):
         self.line = line
@@ -380,18 +1415,31 @@ class Vertical(Constraint, Handler):
     def p2(self) -> Point:
         return self.line.p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2
-        i2 = system.points.index(self.p2) * 2
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2 = self.slots
 
         y[i2] += x[n]
         y[i1] -= x[n]
 
         y[n] = x[i2] - x[i1]
 
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2 = self.slots
+
+        jacobian.addGradient(n, i2, 1.)
+        jacobian.addGradient(n, i1, -1.)
+
 
 class Horizontal(Constraint):
 
+    coordinates = ((0, 1), (1, 1))
+    evaluate = staticmethod(difference)
+    substitution = equality
+
     def __init__(self, line: Line):
         self.line = line
 
@@ -403,116 +1451,78 @@ class Horizontal(Constraint):
     def p2(self) -> Point:
         return self.line.p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2 + 1
-        i2 = system.points.index(self.p2) * 2 + 1
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2 = (i + 1 for i in self.slots)
 
         y[i2] += x[n]
         y[i1] -= x[n]
 
         y[n] = x[i2] - x[i1]
 
-class EraserHandler(Handler):
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2 = (i + 1 for i in self.slots)
 
-    def __init__(self):
-        self.selected_object = None
-
-    def getActiveLine(self, sketch):
-        for line in sketch.lines:
-            if line.hasPoint(sketch.currentPos, 4):
-                return line
-        return None
-
-    def mousePressed(self, sketch):
-        self.selected_object = self.getActiveLine(sketch)
-
-    def mouseReleased(self, sketch):
-        if self.selected_object:
-            sketch.lines.remove(self.selected_object)
-            self.selected_object = None
-
-    def mouseMoved(self, sketch):
-        pass  # Implement this if needed
-class MoveObjectHandler(Handler):
-    def __init__(self):
-        self.selected_object = None
-        self.offset = Point(0, 0)
-
-    def mousePressed(self, sketch):
-        if not self.selected_object:
-            for line in sketch.lines:
-                if line.hasPoint(sketch.currentPos, 4):
-                    self.selected_object = line
-                    self.offset = Point(sketch.currentPos.x - line.p1.x, sketch.currentPos.y - line.p1.y)
-                    break
-            for point in sketch.points:
-                if point.distToPoint(sketch.currentPos) < 4:
-                    self.selected_object = point
-                    self.offset = Point(0, 0)
-                    break
-
-    def mouseReleased(self, sketch):
-        self.selected_object = None
-
-    def mouseMoved(self, sketch):
-        if self.selected_object:
-            new_pos = Point(sketch.currentPos.x - self.offset.x, sketch.currentPos.y - self.offset.y)
-            if isinstance(self.selected_object, Line):
-                delta_x = new_pos.x - self.selected_object.p1.x
-                delta_y = new_pos.y - self.selected_object.p1.y
-                self.selected_object.p1 = new_pos
-                self.selected_object.p2 = Point(self.selected_object.p2.x + delta_x, self.selected_object.p2.y + delta_y)
-            elif isinstance(self.selected_object, Point):
-                self.selected_object.x = new_pos.x
-                self.selected_object.y = new_pos.y
-            sketch.update()
-
-class CoincidentHandler(Handler):
-
-    def __init__(self):
-        self.p1 = None
-
-    def mousePressed(self, sketch):
-        point = sketch.getActivePoint()
-        if point:
-            if not self.p1:
-                self.p1 = point
-                return True
-            else:
-                sketch.system.addConstraint(CoincidentX(self.p1, point))
-                sketch.system.addConstraint(CoincidentY(self.p1, point))
-
-                self.p1 = None
-                sketch.update()
+        jacobian.addGradient(n, i2, 1.)
+        jacobian.addGradient(n, i1, -1.)
 
 
 class CoincidentX(Constraint):
 
+    coordinates = ((0, 0), (1, 0))
+    evaluate = staticmethod(difference)
+    substitution = equality
+
     def __init__(self, p1: Point, p2: Point):
         self.p1 = p1
         self.p2 = p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2
-        i2 = system.points.index(self.p2) * 2
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2 = self.slots
 
         y[i2] += x[n]
         y[i1] -= x[n]
 
         y[n] = x[i2] - x[i1]
 
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2 = self.slots
+
+        jacobian.addGradient(n, i2, 1.)
+        jacobian.addGradient(n, i1, -1.)
+
 
 class CoincidentY(Constraint):
 
+    coordinates = ((0, 1), (1, 1))
+    evaluate = staticmethod(difference)
+    substitution = equality
+
     def __init__(self, p1: Point, p2: Point):
         self.p1 = p1
         self.p2 = p2
 
-    def apply(self, system: System, x: np.ndarray, y: np.ndarray, n: int):
-        i1 = system.points.index(self.p1) * 2 + 1
-        i2 = system.points.index(self.p2) * 2 + 1
+    @property
+    def points(self) -> tuple:
+        return self.p1, self.p2
+
+    def apply(self, system: Cluster, x: np.ndarray, y: np.ndarray, n: int):
+        i1, i2 = (i + 1 for i in self.slots)
 
         y[i2] += x[n]
         y[i1] -= x[n]
 
         y[n] = x[i2] - x[i1]
+
+    def derivatives(self, system: Cluster, x: np.ndarray, jacobian: Jacobian, n: int):
+        i1, i2 = (i + 1 for i in self.slots)
+
+        jacobian.addGradient(n, i2, 1.)
+        jacobian.addGradient(n, i1, -1.)
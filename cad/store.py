@@ -0,0 +1,152 @@
+import numpy as np
+
+from cad.figures import *
+
+
+class Table(object):
+
+    # rows of a growable array, each owned by one entity; removed rows are
+    # reused so the array stays dense
+    def __init__(self, dtype, capacity: int = 1024):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.entities = [None] * capacity
+        self.free = []
+        self.size = 0
+        self._rows = None
+
+    def __len__(self) -> int:
+        return self.size - len(self.free)
+
+    @property
+    def rows(self) -> np.ndarray:
+        # rows in use, in row order
+        if self._rows is None:
+            used = np.ones(self.size, dtype=bool)
+            used[self.free] = False
+            self._rows = np.flatnonzero(used)
+        return self._rows
+
+    def add(self, entity, value) -> int:
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == len(self.data):
+                self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+                self.entities.extend([None] * len(self.entities))
+            row = self.size
+            self.size += 1
+
+        self.data[row] = value
+        self.entities[row] = entity
+        self._rows = None
+        return row
+
+    def remove(self, row: int):
+        self.entities[row] = None
+        self.free.append(row)
+        self._rows = None
+
+    def clear(self):
+        self.entities = [None] * len(self.entities)
+        self.free = []
+        self.size = 0
+        self._rows = None
+
+
+class Store(object):
+
+    # structure of arrays behind the geometry of a drawing: one float64 buffer
+    # holds every vertex, lines and circles refer to it by row. points, lines
+    # and circles added to the store become views on these arrays
+    def __init__(self, capacity: int = 1024):
+        self.points = Table((float, 2), capacity)
+        self.references = np.zeros(capacity, dtype=int)
+        self.lines = Table((int, 2), capacity)
+        self.circles = Table([('center', int), ('radius', float)], capacity)
+
+        # flat view of the coordinates that indexes to python floats, and a
+        # counter bumped on every change so lines can cache what they derive
+        self.flat = memoryview(self.points.data.reshape(-1))
+        self.version = 0
+        # slots written since the spatial index last looked
+        self.moved = set()
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        return self.points.data
+
+    def changed(self):
+        self.version += 1
+
+    def attach(self, point: Point):
+        if point.store is not self:
+            x, y = point.coordinates
+            slot = self.points.add(point, (x, y))
+            if len(self.flat) < self.points.data.size:
+                self.flat = memoryview(self.points.data.reshape(-1))
+            if len(self.references) < len(self.points.data):
+                self.references = np.concatenate([self.references, np.zeros_like(self.references)])
+            self.references[slot] = 0
+            point.attach(self, slot)
+            self.changed()
+        self.references[point.slot] += 1
+
+    def release(self, point: Point):
+        self.references[point.slot] -= 1
+        if not self.references[point.slot]:
+            # a point nothing refers to any more keeps its position on its own
+            slot = point.slot
+            point.detach()
+            self.points.remove(slot)
+            self.changed()
+
+    def addLine(self, line: Line):
+        self.attach(line.p1)
+        self.attach(line.p2)
+        line.attach(self, self.lines.add(line, (line.p1.slot, line.p2.slot)))
+
+    def removeLine(self, line: Line):
+        row = line.row
+        line.detach()
+        self.lines.remove(row)
+        self.release(line.p1)
+        self.release(line.p2)
+
+    def setEndpoint(self, line: Line, end: int, old: Point, new: Point):
+        self.attach(new)
+        self.lines.data[line.row, end] = new.slot
+        self.release(old)
+        self.changed()
+
+    def addCircle(self, circle: Circle):
+        self.attach(circle.center)
+        circle.attach(self, self.circles.add(circle, (circle.center.slot, circle.radius)))
+
+    def removeCircle(self, circle: Circle):
+        row = circle.row
+        circle.detach()
+        self.circles.remove(row)
+        self.release(circle.center)
+
+    def segmentsOf(self, lines: list) -> np.ndarray:
+        # (x1, y1, x2, y2) rows of the given lines
+        rows = np.fromiter((line.row for line in lines), dtype=int, count=len(lines))
+        return self.coordinates[self.lines.data[rows]].reshape(-1, 4)
+
+    def segments(self) -> tuple:
+        # live lines and their (x1, y1, x2, y2) rows
+        rows = self.lines.rows
+        slots = self.lines.data[rows]
+        segments = self.coordinates[slots].reshape(-1, 4)
+        return [self.lines.entities[row] for row in rows], segments
+
+    def clear(self):
+        for table in (self.lines, self.circles):
+            for row in table.rows:
+                table.entities[row].detach()
+            table.clear()
+        for row in self.points.rows:
+            self.points.entities[row].detach()
+        self.points.clear()
+        self.moved.clear()
+        self.changed()
@@ -0,0 +1,21 @@
+from cad.drawing import Drawing
+from cad.figures import *
+
+
+def test_unweld_after_erasing_a_welded_line():
+    drawing = Drawing()
+    a = Line(Point(0, 0), Point(10, 0))
+    b = Line(Point(10, 0), Point(20, 5))
+    drawing.addLine(a)
+    drawing.addLine(b)
+    root = drawing.weld(b.p1, a.p2)
+    drawing.removeLine(a)
+
+    drawing.unweld(root)
+    assert b.coordinates() == (10., 0., 20., 5.)
+    # the line and its two vertices
+    assert len(drawing.index) == 3
+    assert drawing.system.dof == 4
+
+    drawing.removeLine(b)
+    assert len(drawing.index) == 0
@@ -0,0 +1,76 @@
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import pytest
+from PyQt5 import QtWidgets
+
+from cad.figures import *
+from cad.handlers import *
+from cad.sketch import Sketch
+
+application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def sketch():
+    sketch = Sketch()
+    sketch.asynchronous = False
+    yield sketch
+    sketch.solver.stop()
+
+
+def press(sketch, x: float, y: float):
+    sketch.currentPos = sketch.pressedPos = Point(x, y)
+    sketch.handler.mousePressed(sketch)
+
+
+def move(sketch, x: float, y: float):
+    sketch.currentPos = Point(x, y)
+    sketch.handler.mouseMoved(sketch)
+
+
+def release(sketch):
+    sketch.pressedPos = None
+    sketch.handler.mouseReleased(sketch)
+
+
+def test_switching_tools_ends_a_drag(sketch):
+    # escape mid drag swaps the handler before the release
+    sketch.addLine(Line(Point(0, 0), Point(100, 0)))
+    sketch.handler = MoveObjectHandler()
+    press(sketch, 100, 0)
+    move(sketch, 100, 20)
+    assert sketch.system.dragging
+
+    sketch.handler = SelectionHandler()
+    assert not sketch.system.dragging
+
+
+def test_closed_lasso_selects_a_region(sketch):
+    # a freehand lasso ends back where it started
+    lines = [Line(Point(10 * i, 0), Point(10 * i, 10)) for i in range(1, 6)]
+    for line in lines:
+        sketch.addLine(line)
+    sketch.handler = LassoHandler()
+    press(sketch, 0, -5)
+    for x, y in ((60, -5), (60, 15), (0, 15), (0, -4)):
+        move(sketch, x, y)
+    release(sketch)
+
+    assert set(lines) <= sketch.selection
+
+
+def test_drag_keeps_the_cached_layer(sketch):
+    # the dragged line is painted over the layer, which is not redrawn
+    sketch.addLine(Line(Point(0, 0), Point(100, 0)))
+    sketch.addLine(Line(Point(0, 50), Point(100, 50)))
+    sketch.handler = MoveObjectHandler()
+    press(sketch, 100, 0)
+    move(sketch, 100, 10)
+    layer = sketch.staticLayer()
+    move(sketch, 100, 20)
+    assert sketch.staticLayer() is layer
+
+    release(sketch)
+    assert sketch.staticLayer() is not layer
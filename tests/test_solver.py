@@ -0,0 +1,105 @@
+import math
+
+import pytest
+
+from cad.drawing import Drawing
+from cad.figures import *
+from cad.solver import *
+
+
+def test_newton_at_large_scale():
+    # lengths in units squared and angles in units weigh the same, drawings
+    # imported from dxf are thousands of units across
+    drawing = Drawing()
+    line = Line(Point(1000, 2000), Point(7000, 5000))
+    drawing.addLine(line)
+    drawing.system.addConstraint(Length(line, 3700))
+    drawing.system.addConstraint(Angle(line, 17))
+    drawing.system.recount()
+
+    assert drawing.system.stats.converged
+    assert abs(line.length - 3700) < .5
+    assert abs(math.degrees(math.atan2(line.dy, line.dx)) - 17) < 1e-2
+
+
+def test_fsolve_defaults_converge():
+    # the defaults of every backend meet the tolerance results are judged by
+    drawing = Drawing(backend=FsolveBackend())
+    line = Line(Point(0, 0), Point(10, 3))
+    drawing.addLine(line)
+    drawing.system.addConstraint(Length(line, 20))
+    drawing.system.addConstraint(Horizontal(line))
+    drawing.system.recount()
+
+    assert drawing.system.stats.converged
+    assert abs(line.length - 20) < .1
+    assert line.dy == 0.
+
+
+def test_constraint_after_move():
+    # the basis was linearized before the move, a fresh drawing of the moved
+    # geometry takes the constraint
+    drawing = Drawing()
+    line = Line(Point(0, 0), Point(10, 0))
+    drawing.addLine(line)
+    drawing.system.addConstraint(Length(line, 10))
+    drawing.system.recount()
+    drawing.translate([line.p2], -9.5, 10)
+    drawing.system.recount()
+
+    drawing.system.addConstraint(Vertical(line))
+    drawing.system.recount()
+    assert drawing.system.stats.converged
+    assert line.dx == 0.
+    assert abs(line.length - 10) < .1
+
+    # a real conflict is still one after the move
+    with pytest.raises(ConflictingConstraintError):
+        drawing.system.addConstraint(Horizontal(line))
+
+
+def sample(presolve: bool, batched: bool) -> Cluster:
+    # every kind of constraint, on lines that share their vertices
+    points = [Point(0, 0), Point(10, 1), Point(12, 9), Point(1, 11), Point(5, 5)]
+    a, b, c = Line(points[0], points[1]), Line(points[1], points[2]), Line(points[2], points[3])
+    d = Line(points[3], points[4])
+    constraints = [
+        Length(a, 10), Parallel(a, c), Angle(b, 80), Vertical(d), Horizontal(a),
+        CoincidentX(points[0], points[4]), CoincidentY(points[4], points[3]), FixingX(points[0], 0),
+        FixingY(points[0], 0),
+    ]
+    return Cluster(points, constraints, batched=batched, presolve=presolve)
+
+
+@pytest.mark.parametrize('presolve', [False, True])
+def test_batched_matches_scalar(presolve: bool):
+    batched, scalar = sample(presolve, True), sample(presolve, False)
+    x = np.random.default_rng(0).normal(size=batched.size) * 5
+
+    assert np.allclose(batched.system(x), scalar.system(x))
+    assert np.allclose(batched.jacobian(x).toarray(), scalar.jacobian(x).toarray())
+
+
+@pytest.mark.parametrize('batched', [False, True])
+@pytest.mark.parametrize('presolve', [False, True])
+def test_jacobian_matches_finite_differences(presolve: bool, batched: bool):
+    cluster = sample(presolve, batched)
+    x = np.random.default_rng(1).normal(size=cluster.size) * 5
+
+    h = 1e-6
+    columns = [(cluster.system(x + h * e) - cluster.system(x - h * e)) / (2 * h) for e in np.eye(cluster.size)]
+    assert np.allclose(cluster.jacobian(x).toarray(), np.array(columns).T, atol=1e-5)
+
+
+def test_substitution_matches_the_full_system():
+    # the pre-solve merges and pins coordinates, the geometry it reaches
+    # is the one the full lagrange system reaches
+    solutions = []
+    for presolve in (False, True):
+        cluster = sample(presolve, True)
+        cluster.snapshot()
+        result = cluster.solve(LeastSquaresBackend())
+        assert np.abs(cluster.residuals(result.x)).max() < 1e-6
+        solutions.append(cluster.expand(result.x)[:len(cluster.points) * 2])
+
+    assert np.allclose(*solutions, atol=1e-4)